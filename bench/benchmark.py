@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# ECL2.0 モジュールのベンチマーク
+#
+# - bench/fake_ecl.py の API の代替に対して library/ のモジュールを実行し、
+#   実行時間 / API 呼び出し回数 / メモリ使用量の最大値 を計測する
+# - install.py で module_utils/ecl2.py をインストールした Ansible が必要
+#
+# [実行例]
+#   python bench/benchmark.py --sizes 10,1000,10000 --latency 0.01 --json bench.json
+#
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import runpy
+import sys
+import time
+
+try:
+    import tracemalloc
+    HAS_TRACEMALLOC=True
+except ImportError:
+    import resource
+    HAS_TRACEMALLOC=False
+
+from ansible.module_utils import basic
+from ansible.module_utils import ecl2
+from ansible.module_utils._text import to_bytes
+
+here = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
+sys.path.insert(0, here)
+import fake_ecl
+
+LIBRARY_DIR = os.path.join(os.path.dirname(here), 'library')
+
+#
+# シナリオ (名前, モジュール, 引数を返す関数)
+#
+# - 名前で検索するものは一覧の最後のリソースを指定する (最も時間がかかる場合)
+#
+SCENARIOS = [
+    ('volume_stat name', 'ecl2_storage_volume_stat',
+     lambda tenant, size: {'name': 'volume-%05d' % (size - 1)}),
+    ('volume_stat id', 'ecl2_storage_volume_stat',
+     lambda tenant, size: {'id': tenant.resources['volume'][-1]['id']}),
+    ('volume_stat names x10', 'ecl2_storage_volume_stat',
+     lambda tenant, size: {'names': ['volume-%05d' % i for i in range(0, size, max(1, size // 10))]}),
+    ('volume present (exists)', 'ecl2_storage_volume',
+     lambda tenant, size: {'name': 'volume-%05d' % (size - 1), 'virtual_storage': 'storage-00000'}),
+    ('volume create + wait', 'ecl2_storage_volume',
+     lambda tenant, size: {'name': 'bench-volume', 'virtual_storage': 'storage-%05d' % (len(tenant.resources['storage']) - 1)}),
+    ('volume delete', 'ecl2_storage_volume',
+     lambda tenant, size: {'name': 'volume-%05d' % (size - 1), 'state': 'absent'}),
+    ('storage present (exists)', 'ecl2_storage',
+     lambda tenant, size: {'name': 'storage-%05d' % (len(tenant.resources['storage']) - 1)}),
+    ('storage create + wait', 'ecl2_storage',
+     lambda tenant, size: {'name': 'bench-storage', 'subnet': 'subnet-09',
+                           'ip_addr_pool_start': '10.0.9.10', 'ip_addr_pool_end': '10.0.9.200'})
+]
+
+#
+# モジュールの実行
+#
+def run_module(module_name, params, tenant):
+    #
+    # ECL への接続をテナントの代替に置き換える
+    #
+    def connection_from_module(module):
+        ecl2._RUN_STATE['tenant'] = 'bench'
+        return fake_ecl.FakeConnection(tenant)
+    ecl2.ecl2_connection_from_module = connection_from_module
+    ecl2.HAS_ECLSDK = True
+    ecl2._RUN_INFO.clear()
+    ecl2._RUN_STATE.clear()
+
+    basic._ANSIBLE_ARGS = to_bytes(json.dumps({'ANSIBLE_MODULE_ARGS': params}))
+    stdout = sys.stdout
+    sys.stdout = output = io.StringIO() if sys.version_info[0] >= 3 else io.BytesIO()
+    try:
+        runpy.run_path(os.path.join(LIBRARY_DIR, '%s.py' % module_name), run_name='__main__')
+    except SystemExit:
+        pass
+    finally:
+        sys.stdout = stdout
+    try:
+        return json.loads(output.getvalue())
+    except ValueError:
+        return {'failed': True, 'msg': output.getvalue()}
+
+def _peak_memory_start():
+    if HAS_TRACEMALLOC:
+        tracemalloc.start()
+
+def _peak_memory_stop():
+    if HAS_TRACEMALLOC:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+    # tracemalloc が無い場合はプロセス全体の最大値 (KB)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+#
+# シナリオの実行 (毎回新しいテナントを作成する)
+#
+def run_scenario(scenario, size, options):
+    name, module_name, params_function = scenario
+    tenant = fake_ecl.populate(size, options.latency, options.transition, not options.no_server_filters)
+    params = dict(params_function(tenant, size), cloud='bench', wait=True, timeout=options.timeout)
+
+    _peak_memory_start()
+    started = time.time()
+    result = run_module(module_name, params, tenant)
+    wall = time.time() - started
+    peak = _peak_memory_stop()
+
+    return {
+        'scenario'  : name,
+        'module'    : module_name,
+        'size'      : size,
+        'wall'      : round(wall, 4),
+        'calls'     : tenant.total_calls(),
+        'call_detail' : dict(tenant.calls),
+        'peak_memory' : peak,
+        'failed'    : bool(result.get('failed')),
+        'msg'       : result.get('msg')
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ECL2.0 storage modules against a fake ECL API.')
+    parser.add_argument('--sizes', default='10,1000,10000', help='comma separated numbers of volumes in the tenant')
+    parser.add_argument('--scenarios', default=None, help='comma separated scenario names (default: all)')
+    parser.add_argument('--latency', default=0.0, type=float, help='seconds per API call')
+    parser.add_argument('--transition', default=0.0, type=float, help='seconds until create / delete completes')
+    parser.add_argument('--timeout', default=600, type=int, help='module timeout')
+    parser.add_argument('--no-server-filters', action='store_true', help='reject filter / paging arguments like an old API')
+    parser.add_argument('--json', default=None, help='write results as JSON to this file')
+    options = parser.parse_args()
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    scenarios = SCENARIOS
+    if options.scenarios:
+        names = options.scenarios.split(',')
+        scenarios = [scenario for scenario in SCENARIOS if scenario[0] in names]
+
+    results = []
+    print('%-26s %7s %10s %7s %12s  %s' % ('scenario', 'size', 'wall(s)', 'calls', 'peak(KiB)', 'result'))
+    for size in sizes:
+        for scenario in scenarios:
+            result = run_scenario(scenario, size, options)
+            results.append(result)
+            print('%-26s %7d %10.4f %7d %12d  %s' % (result['scenario'], size, result['wall'], result['calls'],
+                                                     result['peak_memory'] // 1024,
+                                                     'failed: %s' % result['msg'] if result['failed'] else 'ok'))
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'latency': options.latency, 'transition': options.transition, 'results': results},
+                      f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
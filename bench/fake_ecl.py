@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# ECL2.0 ストレージ / ネットワーク API の代替 (ベンチマーク用)
+#
+# - eclsdk.connection.Connection と同じ形 (conn.storage.volumes() 等) で呼び出せる
+# - 一覧は limit / marker によるページ取得と、項目の一致による絞り込みに対応する
+# - 作成 / 削除 は transition 秒後に完了する (それまでは creating / deleting)
+# - API 呼び出し毎に latency 秒待ち、呼び出し回数を数える
+#
+import threading
+import time
+import uuid
+
+#
+# 一覧 (details=False) で返す項目
+#
+SUMMARY_FIELDS = ['id', 'name', 'links']
+
+#
+# 存在しないリソースを指定した場合の例外
+#
+class FakeNotFound(Exception):
+
+    def __init__(self, message):
+        super(FakeNotFound, self).__init__(message)
+        self.http_status = 404
+
+#
+# API が返すリソース (属性 / to_dict() で参照する)
+#
+class FakeResource(object):
+
+    def __init__(self, record):
+        self._record = record
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._record.get(name)
+
+    def to_dict(self):
+        return dict(self._record)
+
+#
+# テナント (リソースの保持と API 呼び出しの記録)
+#
+# - server_filters=False の場合、絞り込み / ページ取得 の引数を受け付けない API を再現する (TypeError)
+#
+class FakeTenant(object):
+
+    def __init__(self, latency=0.0, transition=0.0, server_filters=True):
+        self.latency = latency
+        self.transition = transition
+        self.server_filters = server_filters
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.resources = {'storage': [], 'volume': [], 'network': [], 'subnet': []}
+
+    def call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def add(self, kind, record, status=None):
+        record = dict(record)
+        record.setdefault('id', str(uuid.uuid4()))
+        if not status == None:
+            record['status'] = status
+        with self.lock:
+            self.resources[kind].append(record)
+        return record
+
+    #
+    # 作成 / 削除 の状態遷移
+    #
+    def _transition(self, kind, record, status, final):
+        if self.transition <= 0:
+            if final == 'deleted':
+                self.resources[kind].remove(record)
+            else:
+                record['status'] = final
+            return
+        record['status'] = status
+        record['_ready_at'] = time.time() + self.transition
+        record['_final'] = final
+
+    def _refresh(self, kind):
+        now = time.time()
+        for record in list(self.resources[kind]):
+            ready_at = record.get('_ready_at')
+            if ready_at == None or now < ready_at:
+                continue
+            if record['_final'] == 'deleted':
+                self.resources[kind].remove(record)
+            else:
+                record['status'] = record.pop('_final')
+                del record['_ready_at']
+
+    def _public(self, record, details=True):
+        if details:
+            return FakeResource(dict([(key, value) for key, value in record.items() if not key.startswith('_')]))
+        return FakeResource(dict([(key, record.get(key)) for key in SUMMARY_FIELDS]))
+
+    def list(self, kind, method, details=True, **query):
+        if not self.server_filters and len(query) > 0:
+            raise TypeError('%s() got an unexpected keyword argument' % method)
+        self.call(method)
+        limit = query.pop('limit', None)
+        marker = query.pop('marker', None)
+        with self.lock:
+            self._refresh(kind)
+            records = self.resources[kind]
+            if len(query) > 0:
+                records = [record for record in records
+                           if all([record.get(key) == value for key, value in query.items()])]
+            if not marker == None:
+                position = [i for i, record in enumerate(records) if record['id'] == marker]
+                records = records[position[0] + 1:] if len(position) > 0 else []
+            if not limit == None:
+                records = records[:int(limit)]
+            return [self._public(record, details) for record in records]
+
+    def get(self, kind, method, resource_id):
+        self.call(method)
+        with self.lock:
+            self._refresh(kind)
+            for record in self.resources[kind]:
+                if record['id'] == resource_id:
+                    return self._public(record)
+        raise FakeNotFound('%s(%s) is not found.' % (kind, resource_id))
+
+    def create(self, kind, method, attrs):
+        self.call(method)
+        with self.lock:
+            record = dict(attrs, id=str(uuid.uuid4()))
+            self.resources[kind].append(record)
+            self._transition(kind, record, 'creating', 'available')
+            return self._public(record)
+
+    def update(self, kind, method, resource_id, attrs):
+        self.call(method)
+        with self.lock:
+            for record in self.resources[kind]:
+                if record['id'] == resource_id:
+                    record.update(attrs)
+                    return self._public(record)
+        raise FakeNotFound('%s(%s) is not found.' % (kind, resource_id))
+
+    def delete(self, kind, method, resource_id):
+        self.call(method)
+        with self.lock:
+            for record in self.resources[kind]:
+                if record['id'] == resource_id:
+                    self._transition(kind, record, 'deleting', 'deleted')
+                    return None
+        raise FakeNotFound('%s(%s) is not found.' % (kind, resource_id))
+
+#
+# ストレージサービス
+#
+class FakeStorageService(object):
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+
+    def storages(self, details=True, **query):
+        return iter(self.tenant.list('storage', 'storages', details, **query))
+
+    def volumes(self, details=True, **query):
+        return iter(self.tenant.list('volume', 'volumes', details, **query))
+
+    def get_storage(self, storage_id):
+        return self.tenant.get('storage', 'get_storage', storage_id)
+
+    def get_volume(self, volume_id):
+        return self.tenant.get('volume', 'get_volume', volume_id)
+
+    def create_storage(self, **attrs):
+        return self.tenant.create('storage', 'create_storage', attrs)
+
+    def create_volume(self, **attrs):
+        return self.tenant.create('volume', 'create_volume', attrs)
+
+    def update_volume(self, volume, **attrs):
+        return self.tenant.update('volume', 'update_volume', getattr(volume, 'id', volume), attrs)
+
+    def delete_storage(self, storage, ignore_missing=True):
+        return self.tenant.delete('storage', 'delete_storage', getattr(storage, 'id', storage))
+
+    def delete_volume(self, volume, ignore_missing=True):
+        return self.tenant.delete('volume', 'delete_volume', getattr(volume, 'id', volume))
+
+#
+# ネットワークサービス
+#
+class FakeNetworkService(object):
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+
+    def networks(self, **query):
+        return iter(self.tenant.list('network', 'networks', True, **query))
+
+    def subnets(self, **query):
+        return iter(self.tenant.list('subnet', 'subnets', True, **query))
+
+#
+# 接続 (eclsdk.connection.Connection の代わり)
+#
+class FakeConnection(object):
+
+    def __init__(self, tenant):
+        self.storage = FakeStorageService(tenant)
+        self.network = FakeNetworkService(tenant)
+
+#
+# リソース数 size のテナントを作成
+#
+# - 仮想ストレージ: size / 10 個 (最低 1 個)、ボリューム: size 個 (仮想ストレージに均等に割り当てる)
+# - ネットワーク: 1 個、サブネット: 10 個
+#
+def populate(size, latency=0.0, transition=0.0, server_filters=True):
+    tenant = FakeTenant(latency, transition, server_filters)
+    network = tenant.add('network', {'name': 'network-0'})
+    subnets = [tenant.add('subnet', {'name': 'subnet-%02d' % i, 'network_id': network['id'],
+                                     'cidr': '10.0.%d.0/24' % i}) for i in range(10)]
+    storages = []
+    for i in range(max(1, size // 10)):
+        subnet = subnets[i % len(subnets)]
+        storages.append(tenant.add('storage', {
+            'name'              : 'storage-%05d' % i,
+            'network_id'        : network['id'],
+            'subnet_id'         : subnet['id'],
+            'volume_type_id'    : '6328d234-7939-4d61-9216-736de66d15f9',
+            'ip_addr_pool'      : {'start': '10.0.0.10', 'end': '10.0.0.200'}
+        }, 'available'))
+    for i in range(size):
+        storage = storages[i % len(storages)]
+        tenant.add('volume', {
+            'name'                  : 'volume-%05d' % i,
+            'virtual_storage_id'    : storage['id'],
+            'size'                  : 100,
+            'iops_per_gb'           : '2',
+            'initiator_iqns'        : [],
+            'availability_zone'     : 'zone1-groupa'
+        }, 'available')
+    return tenant
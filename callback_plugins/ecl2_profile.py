@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: ecl2_profile
+    type: aggregate
+    short_description: ECL2.0 モジュールの API 呼び出しの集計
+    description:
+        - ecl2_* タスクの結果の ecl2_metrics をタスク毎 / ホスト毎に集計する
+        - Playbook の終了時に API 時間の多い順に表示し、JSON に保存する
+    requirements:
+        - ansible.cfg の callback_whitelist (callbacks_enabled) に ecl2_profile を追加する
+    options:
+        path:
+            description: 集計結果 (JSON) の保存先
+            default: ~/.cache/ecl2-ansible/profile.json
+            env:
+                - name: ECL2_PROFILE_PATH
+            ini:
+                - section: callback_ecl2_profile
+                  key: path
+            type: path
+        top:
+            description: 表示するタスク / ホスト の数
+            default: 20
+            env:
+                - name: ECL2_PROFILE_TOP
+            ini:
+                - section: callback_ecl2_profile
+                  key: top
+            type: int
+'''
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+#
+# 集計する項目
+#
+METRIC_KEYS = ['requests', 'errors', 'bytes', 'duration', 'wait']
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'ecl2_profile'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self.started = time.time()
+        self.play = None
+        self.tasks = {}
+        self.hosts = {}
+        self.order = []
+
+    def _option(self, name, default):
+        try:
+            value = self.get_option(name)
+        except Exception:
+            value = None
+        if value == None:
+            value = os.environ.get('ECL2_PROFILE_%s' % name.upper(), default)
+        return value
+
+    def v2_playbook_on_play_start(self, play):
+        self.play = play.get_name()
+
+    #
+    # 結果から ecl2_metrics を取り出す (ループの場合は各要素から)
+    #
+    def _metrics(self, result):
+        metrics = []
+        if isinstance(result.get('ecl2_metrics'), dict):
+            metrics.append(result['ecl2_metrics'])
+        for item in result.get('results') or []:
+            if isinstance(item, dict) and isinstance(item.get('ecl2_metrics'), dict):
+                metrics.append(item['ecl2_metrics'])
+        return metrics
+
+    def _add(self, totals, metrics):
+        totals['runs'] += 1
+        for key in METRIC_KEYS:
+            totals[key] += metrics.get(key) or 0
+
+    def _totals(self, **kwargs):
+        totals = dict([(key, 0) for key in METRIC_KEYS])
+        totals['runs'] = 0
+        totals['failed'] = 0
+        totals.update(kwargs)
+        return totals
+
+    def _record(self, result, failed=False):
+        metrics_list = self._metrics(result._result)
+        if len(metrics_list) == 0:
+            return
+        task = result._task
+        task_key = task._uuid
+        if not task_key in self.tasks:
+            self.tasks[task_key] = self._totals(play=self.play, task=task.get_name(), action=task.action)
+            self.order.append(task_key)
+        host = result._host.get_name()
+        if not host in self.hosts:
+            self.hosts[host] = self._totals(host=host)
+        for metrics in metrics_list:
+            self._add(self.tasks[task_key], metrics)
+            self._add(self.hosts[host], metrics)
+
+        #
+        # 失敗したタスクの数 (ループの場合は結果毎に 1 回)
+        #
+        if failed:
+            self.tasks[task_key]['failed'] += 1
+            self.hosts[host]['failed'] += 1
+
+    def v2_runner_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result, True)
+
+    def _rounded(self, totals):
+        totals = dict(totals)
+        for key in ['duration', 'wait']:
+            totals[key] = round(totals[key], 3)
+        return totals
+
+    def _ranking(self, entries):
+        return sorted([self._rounded(entry) for entry in entries],
+                      key=lambda entry: (entry['duration'], entry['requests'], entry['wait']), reverse=True)
+
+    def _display_table(self, title, label, entries, top):
+        self._display.banner(title)
+        self._display.display('%-50s %8s %8s %8s %12s %10s %10s' % (label, 'calls', 'errors', 'failed', 'bytes', 'api(s)', 'wait(s)'))
+        for entry in entries[:top]:
+            name = entry.get('host') or '%s: %s' % (entry['play'], entry['task'])
+            self._display.display('%-50s %8d %8d %8d %12d %10.3f %10.3f' % (name[:50], entry['requests'], entry['errors'], entry['failed'],
+                                                                             entry['bytes'], entry['duration'], entry['wait']))
+
+    def v2_playbook_on_stats(self, stats):
+        if len(self.tasks) == 0:
+            return
+        top = int(self._option('top', 20))
+        tasks = self._ranking([self.tasks[key] for key in self.order])
+        hosts = self._ranking(self.hosts.values())
+        total = self._totals()
+        for entry in self.tasks.values():
+            for key in METRIC_KEYS + ['runs', 'failed']:
+                total[key] += entry[key]
+
+        self._display_table('ECL2.0 API PROFILE (TASKS)', 'task', tasks, top)
+        self._display_table('ECL2.0 API PROFILE (HOSTS)', 'host', hosts, top)
+
+        #
+        # JSON で保存
+        #
+        path = os.path.expanduser(self._option('path', os.path.join('~', '.cache', 'ecl2-ansible', 'profile.json')))
+        profile = {
+            'started'  : round(self.started, 3),
+            'elapsed'  : round(time.time() - self.started, 3),
+            'total'    : self._rounded(total),
+            'tasks'    : tasks,
+            'hosts'    : hosts
+        }
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            with open(path, 'w') as f:
+                json.dump(profile, f, indent=2, sort_keys=True)
+            self._display.display('ECL2.0 API profile: %s' % path)
+        except (IOError, OSError) as e:
+            self._display.warning('Failed to write ECL2.0 API profile (%s): %s' % (path, e))
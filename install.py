@@ -29,12 +29,9 @@ def main():
     print('Ansible path is %s' % ansible_path)
 
     #
-    # バージョン毎に適切なディレクトリが存在するかを確認
+    # モジュール共通処理 (ansible.module_utils.ecl2) の配置先
     #
-    if (major, minor) == (2, 4):
-        module_utils_path = os.path.join(ansible_path, 'module_utils')
-    else:
-        module_utils_path = os.path.join(ansible_path, 'module_utils', 'cloud', 'ecl2')
+    module_utils_path = os.path.join(ansible_path, 'module_utils')
     if not os.path.exists(module_utils_path):
         print('Module utils directory (%s) does not exist' % module_utils_path)
         sys.exit(1)
@@ -70,15 +67,14 @@ def main():
         if filename.endswith('.py'):
             ansible_module_files.append(filename)
 
-#    # Copy ecl2.py to module_utils
-#    if 'ecl2.py' not in ansible_module_files:
-#        print('Could not find ecl2 module utils file')
-#        sys.exit(1)
-#
-#    print('Copying ecl2.py to %s' % module_utils_path)
-#    shutil.copy(os.path.join(ansible_modules_sourcedir, 'ecl2.py'), os.path.join(module_utils_path, 'ecl2.py'))
-#
-#    ansible_module_files.remove('ecl2.py')
+    #
+    # モジュール共通処理を module_utils にコピー
+    #
+    module_utils_sourcedir = os.path.join(here, 'module_utils')
+    for filename in os.listdir(module_utils_sourcedir):
+        if filename.endswith('.py'):
+            print('Copying %s to %s' % (filename, module_utils_path))
+            shutil.copy(os.path.join(module_utils_sourcedir, filename), os.path.join(module_utils_path, filename))
 
     #
     # ecl2 用 の ディレクトリ作成
@@ -101,6 +97,20 @@ def main():
             print('Copying %s' % destination)
         shutil.copy(source, destination)
 
+    #
+    # プラグインのコピー
+    #
+    for plugin_type in ['inventory', 'callback']:
+        plugin_sourcedir = os.path.join(here, '%s_plugins' % plugin_type)
+        plugin_path = os.path.join(ansible_path, 'plugins', plugin_type)
+        if not os.path.isdir(plugin_path):
+            print('Plugin directory (%s) does not exist, skipping %s plugins' % (plugin_path, plugin_type))
+            continue
+        for filename in os.listdir(plugin_sourcedir):
+            if filename.endswith('.py'):
+                print('Copying %s to %s' % (filename, plugin_path))
+                shutil.copy(os.path.join(plugin_sourcedir, filename), os.path.join(plugin_path, filename))
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: ecl2_storage
+    plugin_type: inventory
+    short_description: ECL2.0 storage inventory source
+    description:
+        - ECL2.0 の 仮想ストレージのボリュームをホストとし、仮想ストレージ / アベイラビリティゾーン / iops_per_gb 毎のグループを作成する
+        - 一覧は Ansible の inventory cache に保存し、有効期間内は API を呼び出さない
+        - 設定ファイル名は ecl2_storage.yml または ecl2_storage.yaml で終わる必要がある
+    extends_documentation_fragment:
+        - inventory_cache
+    options:
+        plugin:
+            description: このプラグインを使用するためのトークン
+            required: true
+            choices: ['ecl2_storage']
+        cloud:
+            description: clouds.yaml の クラウド名
+            required: true
+        token_cache:
+            description: Keystone トークンのキャッシュを使用する
+            type: bool
+            default: false
+        token_cache_path:
+            description: Keystone トークンのキャッシュの保存先
+            type: path
+        refresh:
+            description: キャッシュを使用せず取得し直すリソースの種別 (storage / volume)
+            type: list
+            default: []
+            env:
+                - name: ECL2_STORAGE_INVENTORY_REFRESH
+        hostname:
+            description: ホスト名に使用するボリュームの項目 (名前が重複する場合は id を使用する)
+            default: name
+            choices: ['name', 'id']
+'''
+
+EXAMPLES = '''
+# ecl2_storage.yml
+plugin: ecl2_storage
+cloud: devel
+cache: yes
+cache_plugin: jsonfile
+cache_connection: ~/.cache/ecl2-ansible/inventory
+cache_timeout: 600
+'''
+
+import re
+from collections import Counter
+
+from ansible.errors import AnsibleError
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable
+
+try:
+    from ansible.module_utils.ecl2 import HAS_ECLSDK, ecl2_connection_from_cloud, ecl2_iter_resources
+    HAS_ECL2_MODULE_UTILS=True
+except ImportError:
+    HAS_ECL2_MODULE_UTILS=False
+
+#
+# 取得するリソースの種別
+#
+RESOURCE_KINDS = ['storage', 'volume']
+
+class InventoryModule(BaseInventoryPlugin, Cacheable):
+
+    NAME = 'ecl2_storage'
+
+    def verify_file(self, path):
+        if super(InventoryModule, self).verify_file(path):
+            return path.endswith(('ecl2_storage.yml', 'ecl2_storage.yaml'))
+        return False
+
+    #
+    # ECL接続 (一覧の取得が必要になった時点で接続する)
+    #
+    def _connection(self):
+        if self._ecl2 == None:
+            if not HAS_ECL2_MODULE_UTILS or not HAS_ECLSDK:
+                raise AnsibleError('ECLSDK and ansible.module_utils.ecl2 are required for ecl2_storage inventory.')
+            self._ecl2 = ecl2_connection_from_cloud(self.get_option('cloud'),
+                                                    token_cache=self.get_option('token_cache'),
+                                                    token_cache_path=self.get_option('token_cache_path'))
+        return self._ecl2
+
+    #
+    # リソースの一覧 (キャッシュが有効な種別はキャッシュを使用する)
+    #
+    def _resources(self, cache_key, use_cache):
+        cached = {}
+        if use_cache:
+            try:
+                cached = self._cache[cache_key]
+            except KeyError:
+                cached = {}
+
+        refresh = self.get_option('refresh') or []
+        for kind in refresh:
+            if not kind in RESOURCE_KINDS:
+                raise AnsibleError('refresh must be a list of %s: %s' %(RESOURCE_KINDS, kind))
+
+        resources = {}
+        updated = False
+        for kind in RESOURCE_KINDS:
+            if kind in cached and not kind in refresh:
+                resources[kind] = cached[kind]
+                continue
+            resources[kind] = [resource.to_dict()
+                               for resource in ecl2_iter_resources(self._connection(), kind, details=True)]
+            updated = True
+
+        if self.get_option('cache') and (updated or not use_cache):
+            self._cache[cache_key] = resources
+        return resources
+
+    def _group_name(self, prefix, value):
+        return re.sub(r'[^A-Za-z0-9_]', '_', '%s_%s' %(prefix, value))
+
+    #
+    # インベントリの作成
+    #
+    def _populate(self, resources):
+        storages = dict([(storage['id'], storage) for storage in resources['storage']])
+        self.inventory.add_group('ecl2_storage')
+
+        #
+        # 仮想ストレージ毎のグループ
+        #
+        for storage in resources['storage']:
+            group = self._group_name('ecl2_storage', storage['name'])
+            self.inventory.add_group(group)
+            self.inventory.add_child('ecl2_storage', group)
+            self.inventory.set_variable(group, 'ecl2_virtual_storage', storage)
+
+        #
+        # ボリューム (ホスト)
+        #
+        counts = Counter([volume['name'] for volume in resources['volume']])
+        for volume in resources['volume']:
+            hostname = volume[self.get_option('hostname')]
+            if counts[volume['name']] > 1:
+                hostname = volume['id']
+            self.inventory.add_host(hostname, group='ecl2_storage')
+            self.inventory.set_variable(hostname, 'ecl2_volume', volume)
+
+            storage = storages.get(volume.get('virtual_storage_id'))
+            if not storage == None:
+                self.inventory.add_host(hostname, group=self._group_name('ecl2_storage', storage['name']))
+            if volume.get('availability_zone'):
+                group = self._group_name('ecl2_az', volume['availability_zone'])
+                self.inventory.add_group(group)
+                self.inventory.add_host(hostname, group=group)
+            if not volume.get('iops_per_gb') == None:
+                group = self._group_name('ecl2_iops_per_gb', volume['iops_per_gb'])
+                self.inventory.add_group(group)
+                self.inventory.add_host(hostname, group=group)
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+        self._ecl2 = None
+
+        #
+        # --flush-cache の場合 (cache=False) はキャッシュを読まずに取得し直す
+        #
+        cache_key = self.get_cache_key(path)
+        use_cache = self.get_option('cache') and cache
+        self._populate(self._resources(cache_key, use_cache))
@@ -1,112 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
-
-try:
-    import ecl as eclsdk
-    HAS_ECLSDK=True
-except:
-    HAS_ECLSDK=False
-
-#
-# ECL接続
-#
-def _get_ecl_connection_from_module(module):
-    try:
-        #
-        # モジュールから接続情報を取得するためのユーティリティを読み込み
-        #
-        from ansible.module_utils.openstack import openstack_cloud_from_module
-
-        #
-        # Cloud インスタンスの取得
-        #
-        sdk, cloud = openstack_cloud_from_module(module)
-    except:
-        #
-        # Clouds.yaml の 情報読み込み
-        #
-	import openstack
-	cloud_config = module.params['cloud']
-	cloud = openstack.connect(cloud=cloud_config)
-
-    #
-    # 設定情報の取り出し
-    #
-    # [参考]
-    # {
-    #   'username'          : 'API 鍵',
-    #   'password'          : 'API 秘密鍵',
-    #   'project_id'        : 'テナントID',
-    #   'user_domain_id'    : 'default',
-    #   'project_domain_id' : 'default',
-    #   'auth_url'          : '認証サーバURL'
-    # }
-    #
-    auth_args = cloud.config.get_auth_args()
-
-    #
-    # 不要な項目はフィルタ
-    #
-    ecl2_args = {
-        'username'          : auth_args['username'],
-        'password'          : auth_args['password'],
-        'project_id'        : auth_args['project_id'],
-        'user_domain_id'    : auth_args['user_domain_id'],
-        'project_domain_id' : auth_args['project_domain_id'],
-        'auth_url'          : auth_args['auth_url']
-    }
-
-    #
-    # ECL2.0に接続する
-    #
-    return eclsdk.connection.Connection(**ecl2_args)
-
-#
-# 仮想ストレージを名前で検索
-#
-def _find_storage_by_name(cloud_ecl2, name):
-    for storage in cloud_ecl2.storage.storages(False):
-        storage_dict = storage.to_dict()
-        if storage_dict['name'] == name:
-            return storage_dict
-    return None
-
-#
-# 仮想ストレージのボリュームを名前で検索
-#
-def _find_storage_volume_by_name(cloud_ecl2, name):
-    for volume in cloud_ecl2.storage.volumes(False):
-        volume_dict = volume.to_dict()
-        if volume_dict['name'] == name:
-            return volume_dict
-    return None
+from ansible.module_utils.openstack import openstack_module_kwargs
+from ansible.module_utils.ecl2 import HAS_ECLSDK, ecl2_argument_spec, ecl2_connection_from_module, ecl2_exit_json, ecl2_fail_json, ecl2_run
+from ansible.module_utils.ecl2 import Ecl2Waiter, ecl2_delete_resources, ecl2_job, ecl2_name_pattern, ecl2_plan, ecl2_snapshot_from_module, ecl2_wait_error
+from ansible.module_utils.ecl2 import DELETING_STATUSES, STORAGE_VOLUME_TYPE_ID
 
 #
-# 仮想ネットワークの検索
+# 仮想ストレージ作成時の引数を取得
 #
-def _find_network_by_name(cloud_ecl2, name):
-    for network in cloud_ecl2.network.networks():
-        network_dict = network.to_dict()
-        if network_dict['name'] == name:
-            return network_dict
-    return None
-
-#
-# 仮想サブネットの検索
-#
-def _find_network_subnet_by_name(cloud_ecl2, name):
-    for subnet in cloud_ecl2.network.subnets():
-        subnet_dict = subnet.to_dict()
-        if subnet_dict['name'] == name:
-            return subnet_dict
-    return None
-
-#
-# 仮想ストレージの作成
-#
-def _create_storage(module, cloud_ecl2):
+def _storage_args(module, snapshot):
     #
     # 必要な引数の取得
     #
@@ -114,132 +17,183 @@ def _create_storage(module, cloud_ecl2):
     subnet_name = module.params['subnet']
     ip_addr_pool_start = module.params['ip_addr_pool_start']
     ip_addr_pool_end = module.params['ip_addr_pool_end']
-    #
-    # 待機時間の取得
-    #
-    wait = module.params['wait']
-    timeout = int(module.params['timeout'])
 
     #
     # サブネットの入力チェック
     #
     if subnet_name == None:
-        module.fail_json(msg='Please input subnet field.')
+        ecl2_fail_json(module, msg='Please input subnet field.')
         return False
 
     #
     # サブネットの取得
     #
-    subnet = _find_network_subnet_by_name(cloud_ecl2, subnet_name)
+    subnet = snapshot.find('subnet', subnet_name)
     if subnet == None:
-        module.fail_json(msg='Network subnet(%s) is not exist.' %(subnet_name))
+        ecl2_fail_json(module, msg='Network subnet(%s) is not exist.' %(subnet_name))
         return False
 
     #
     # IPの確認
     #
     if ip_addr_pool_start == None or ip_addr_pool_end == None:
-        module.fail_json(msg='Please check ip_addr_pool_start & ip_addr_pool_end field.')
+        ecl2_fail_json(module, msg='Please check ip_addr_pool_start & ip_addr_pool_end field.')
         return False
 
     #
     # 引数の取得
     #
-    args = {
+    return {
         'name' : name,
         'network_id' : subnet['network_id'],
         'subnet_id' : subnet['id'],
-        'volume_type_id' : '6328d234-7939-4d61-9216-736de66d15f9',
+        'volume_type_id' : STORAGE_VOLUME_TYPE_ID,
         'ip_addr_pool' : {
             'start' : ip_addr_pool_start,
             'end'   : ip_addr_pool_end
         }
     }
 
+#
+# 仮想ストレージの作成
+#
+def _create_storage(module, cloud_ecl2, snapshot):
+    #
+    # 待機時間の取得
+    #
+    wait = module.params['wait']
+    timeout = int(module.params['timeout'])
+
+    #
+    # 引数の取得
+    #
+    args = _storage_args(module, snapshot)
+
     #
     # ストレージの作成
     #
     new_storage = cloud_ecl2.storage.create_storage(**args)
+    snapshot.created('storage', new_storage.to_dict())
+    job = ecl2_job('storage', new_storage.to_dict(), 'available', timeout)
     if wait == True:
-        cloud_ecl2.storage.wait_for_status(new_storage, status='available', wait=timeout)
-    return True
+        waiter = Ecl2Waiter(cloud_ecl2, 'storage', timeout)
+        waiter.add(new_storage.id)
+        error = ecl2_wait_error(waiter.wait())
+        if not error == None:
+            ecl2_fail_json(module, msg='Virtual storage(%s) is not available: %s' %(new_storage.name, error))
+            return None
+    return job
 
 #
 # 仮想ストレージの削除
 #
-def _delete_storage_by_name(cloud_ecl2, name):
-    # ストレージの検索
-    storage = _find_storage_by_name(cloud_ecl2, name)
-    if not storage == None:
-        # ストレージの削除
-        storage_id = storage['id']
-        cloud_ecl2.storage.delete_storage(storage_id)
-        return True
-    return False
-
-#
-# 仮想ストレージ内にボリュームを作成
-#
-def _create_storage_volume(module, cloud_ecl2):
-    #
-    # 必要な引数の取得
-    #
-    name = module.params['name']
-    size = module.params['size']
-    iops_per_gb = module.params['iops_per_gb']
-    virtual_storage_name = module.params['virtual_storage']
-    availability_zone = module.params['availability_zone']
+def _delete_storage(module, cloud_ecl2, storage, snapshot):
     #
     # 待機時間の取得
     #
     wait = module.params['wait']
     timeout = int(module.params['timeout'])
 
-    #
-    # ストレージの検索
-    #
-    storage = _find_storage_by_name(cloud_ecl2, virtual_storage_name)
-    if storage == None:
-        module.fail_json(msg='Virtual storage(%s) is not exist.' %(virtual_storage_name))
-        return False
+    storage_id = storage['id']
+    cloud_ecl2.storage.delete_storage(storage_id)
+    snapshot.deleted('storage', storage_id)
+    job = ecl2_job('storage', storage, 'deleted', timeout)
+    if wait == True:
+        waiter = Ecl2Waiter(cloud_ecl2, 'storage', timeout)
+        waiter.add(storage_id, 'deleted')
+        error = ecl2_wait_error(waiter.wait())
+        if not error == None:
+            ecl2_fail_json(module, msg='Virtual storage(%s) is not deleted: %s' %(storage['name'], error), changed=True, job=job)
+            return None
+    return job
+
+#
+# 仮想ストレージ内のボリュームの一覧
+#
+def _storage_volumes(snapshot, storages):
+    if len(storages) == 1:
+        return snapshot.list('volume', virtual_storage_id=storages[0]['id'])
+    storage_ids = set([storage['id'] for storage in storages])
+    return [volume for volume in snapshot.list('volume') if volume.get('virtual_storage_id') in storage_ids]
+
+#
+# 仮想ストレージ内のボリュームを全て削除 (cascade=yes の場合)
+#
+# - 削除は最大 max_concurrency 件ずつ並列に実行する
+# - 仮想ストレージはボリュームが残っていると削除できないため、
+#   wait の指定に関わらず全てのボリュームが無くなるまで待機する
+#
+def _delete_storage_volumes(module, cloud_ecl2, storages, snapshot):
+    timeout = int(module.params['timeout'])
+    max_concurrency = module.params['max_concurrency']
+
+    volumes = _storage_volumes(snapshot, storages)
+    results = ecl2_delete_resources(cloud_ecl2, snapshot, 'volume', volumes, max_concurrency, timeout, True)
+    failed = [result for result in results if result.get('failed')]
+    if len(failed) > 0:
+        ecl2_fail_json(module, msg='Failed to delete volumes of virtual storage(%s): %s'
+                               %(', '.join([storage['name'] for storage in storages]),
+                                 ', '.join(['%s: %s' %(result['name'], result['msg']) for result in failed])),
+                               changed=any(result['changed'] for result in results), volumes=results)
+    return results
+
+#
+# 名前のパターンに一致する仮想ストレージを一括で削除
+#
+# - 1回の一覧取得で一致するものを決め、削除中のものは削除しない
+# - 削除する数が max_deletes を超える場合は何も削除せずにエラーとする
+#
+def _delete_storages_by_pattern(module, cloud_ecl2, snapshot):
+    pattern = module.params['name_pattern']
+    max_deletes = module.params['max_deletes']
+    cascade = module.params['cascade']
+    timeout = int(module.params['timeout'])
+
+    if not module.params['state'] == 'absent':
+        ecl2_fail_json(module, msg='name_pattern can only be used with state=absent.')
+
+    match = ecl2_name_pattern(module)
+    storages = [storage for storage in snapshot.list('storage') if match(storage['name'])]
+    deletable = [storage for storage in storages if not storage.get('status') in DELETING_STATUSES]
+    if not max_deletes == None and len(deletable) > max_deletes:
+        ecl2_fail_json(module, msg='name_pattern(%s) matched %d virtual storages, more than max_deletes(%d).'
+                               %(pattern, len(deletable), max_deletes), names=[storage['name'] for storage in deletable])
 
     #
-    # 引数の取得
+    # チェックモードの場合は計画だけを返す
     #
-    args = {
-        'name'                  : name,
-        'size'                  : int(size),        # サイズは整数値型でないとパラメータ不正が起こる
-        'iops_per_gb'           : str(iops_per_gb), # iopsは文字列型でないとパラメータ不正が起こる
-        'virtual_storage_id'    : storage['id'],
-        'availability_zone'     : availability_zone
-    }
+    if module.check_mode:
+        plans = [ecl2_plan('storage', storage['name'], storage, None) for storage in deletable]
+        if cascade and len(deletable) > 0:
+            plans = [ecl2_plan('volume', volume['name'], volume, None)
+                     for volume in _storage_volumes(snapshot, deletable)] + plans
+        ecl2_exit_json(module, changed=len(plans) > 0, plans=plans, diff=[plan['diff'] for plan in plans])
+        return True
 
     #
-    # ボリュームの作成
+    # 仮想ストレージ内のボリュームの削除
     #
-    new_volume = cloud_ecl2.storage.create_volume(**args)
-    if wait == True:
-        cloud_ecl2.storage.wait_for_status(new_volume, status='available', wait=timeout)
-    return True
+    volumes = []
+    if cascade and len(deletable) > 0:
+        volumes = _delete_storage_volumes(module, cloud_ecl2, deletable, snapshot)
 
-#
-# 仮想ストレージ内のボリュームを削除
-#
-def _delete_storage_volume_by_name(module, cloud_ecl2):
     #
-    # 必要な引数の取得
+    # 仮想ストレージの削除
     #
-    name = module.params['name']
+    results = ecl2_delete_resources(cloud_ecl2, snapshot, 'storage', storages,
+                                    module.params['max_concurrency'], timeout, module.params['wait'])
+    changed = any(result['changed'] for result in results + volumes)
+    failed = [result['name'] for result in results if result.get('failed')]
+    if len(failed) > 0:
+        ecl2_fail_json(module, msg='Failed to delete virtual storages: %s' %(', '.join(failed)),
+                               changed=changed, results=results, volumes=volumes)
 
     #
-    # ボリュームの検索
+    # 正常終了
     #
-    volume = _find_storage_volume_by_name(cloud_ecl2, name)
-    if not volume == None:
-        # ボリュームの削除
-        volume_id = volume['id']
-        cloud_ecl2.storage.delete_volume(volume_id)
-    return False
+    jobs = [result['job'] for result in results if 'job' in result]
+    ecl2_exit_json(module, changed=changed, results=results, volumes=volumes, jobs=jobs)
+    return True
 
 #
 # ストレージサービス: ブロックストレージの作成
@@ -248,18 +202,31 @@ def main():
     #
     # Open Stack 共通引数取得
     # - name		: 仮想ストレージ名
+    # - id		: 仮想ストレージID (指定した場合は名前で検索しない)
     # - subnet_id	: サブネットID
     # - volume_type_id	= "6328d234-7939-4d61-9216-736de66d15f9",(固定？)
     # - ip_addr_pool	= { 'start' : '10.0.2.201', 'end' : '10.0.2.231' }
-    #
-    argument_spec = openstack_full_argument_spec(
-        name=dict(required=True),
+    # - cascade		: 削除時に仮想ストレージ内のボリュームも削除する
+    # - name_pattern	: 削除する仮想ストレージ名のパターン (pattern_type: glob / regex)
+    # - max_deletes	: name_pattern で削除できる最大数
+    #
+    argument_spec = ecl2_argument_spec(
+        name=dict(required=False),
+        id=dict(required=False),
+        name_pattern=dict(required=False),
+        pattern_type=dict(default='glob', choices=['glob', 'regex']),
+        max_deletes=dict(default=None, type='int'),
         subnet=dict(required=False),
         ip_addr_pool_start=dict(required=False),
         ip_addr_pool_end=dict(required=False),
-        state=dict(default='present', choices=['absent', 'present'])
+        state=dict(default='present', choices=['absent', 'present']),
+        cascade=dict(default=False, type='bool'),
+        max_concurrency=dict(default=10, type='int')
+    )
+    module_kwargs = openstack_module_kwargs(
+        required_one_of=[['name', 'id', 'name_pattern']],
+        mutually_exclusive=[['name', 'name_pattern'], ['id', 'name_pattern']]
     )
-    module_kwargs = openstack_module_kwargs()
 
     #
     # Ansible Module の 定義
@@ -271,22 +238,68 @@ def main():
     )
 
     #
-    # 仮想ストレージ名の取得
+    # モジュールの本体の実行 (サーキットブレーカーが遮断中の場合は異常終了とする)
+    #
+    return ecl2_run(module, _run)
+
+#
+# モジュールの本体
+#
+def _run(module):
+    #
+    # 仮想ストレージ名 / ID の取得
     #
     name = module.params['name']
+    storage_id = module.params['id']
     state = module.params['state']
 
     #
     # ECLSDKがインストールされているかの確認
     #
     if HAS_ECLSDK == False:
-        module.fail_json(msg='ECLSDK is not exist.')
+        ecl2_fail_json(module, msg='ECLSDK is not exist.')
 
     #
-    # ECLへの接続
+    # ECLへの接続 (保存したスナップショットから計画する場合は接続しない)
     #
-    ecl2 = _get_ecl_connection_from_module(module)
-    storage = _find_storage_by_name(ecl2, name)
+    ecl2 = None
+    if module.params['plan_snapshot'] == None:
+        ecl2 = ecl2_connection_from_module(module)
+    # (ボリュームの仮想ストレージ / 状態 を参照するため、cascade / name_pattern の場合は詳細の一覧を取得する)
+    snapshot = ecl2_snapshot_from_module(module, ecl2,
+                                         details=module.params['cascade'] or not module.params['name_pattern'] == None)
+
+    #
+    # 名前のパターンで一括削除する場合
+    #
+    if not module.params['name_pattern'] == None:
+        return _delete_storages_by_pattern(module, ecl2, snapshot)
+
+    #
+    # 仮想ストレージの検索 (ID が指定された場合は ID で取得)
+    #
+    if not storage_id == None:
+        storage = snapshot.get('storage', storage_id)
+        name = storage_id if storage == None else storage['name']
+    else:
+        storage = snapshot.find('storage', name)
+
+    #
+    # チェックモードの場合は計画だけを返す
+    #
+    if module.check_mode:
+        after = None
+        volume_plans = []
+        if state == 'present':
+            if storage == None and not storage_id == None:
+                ecl2_fail_json(module, msg='Virtual storage(%s) is not exist.' %(storage_id))
+            after = storage if not storage == None else _storage_args(module, snapshot)
+        elif module.params['cascade'] and not storage == None:
+            volume_plans = [ecl2_plan('volume', volume['name'], volume, None) for volume in _storage_volumes(snapshot, [storage])]
+        plan = ecl2_plan('storage', name, storage, after)
+        ecl2_exit_json(module, changed=not plan['action'] == 'none', id=plan['id'], plan=plan, volumes=volume_plans,
+                       diff=[volume_plan['diff'] for volume_plan in volume_plans] + [plan['diff']])
+        return True
 
     #
     # 仮想ストレージの作成
@@ -296,34 +309,47 @@ def main():
         # 既に仮想ストレージが存在する場合
         #
         if not storage == None:
-            module.exit_json(msg = 'Virtual storage(%s) is already exist.' %(name), changed=False)
+            ecl2_exit_json(module, msg = 'Virtual storage(%s) is already exist.' %(name), changed=False, id=storage['id'])
+
+        #
+        # ID が指定された仮想ストレージは作成できない
+        #
+        if not storage_id == None:
+            ecl2_fail_json(module, msg='Virtual storage(%s) is not exist.' %(storage_id))
 
         #
         # 仮想ストレージの作成
         #
-        _create_storage(module, ecl2)
+        job = _create_storage(module, ecl2, snapshot)
 
         #
         # 正常終了
         #
-        module.exit_json(changed=True)
+        ecl2_exit_json(module, changed=True, id=job['id'], job=job)
         return True
     else:
         #
         # 既に仮想ストレージが存在しない場合
         #
         if storage == None:
-            module.exit_json(msg = 'Virtual storage(%s) is not exist.' %(name), changed=False)
+            ecl2_exit_json(module, msg = 'Virtual storage(%s) is not exist.' %(name), changed=False, id=storage_id)
+
+        #
+        # 仮想ストレージ内のボリュームの削除
+        #
+        volumes = []
+        if module.params['cascade']:
+            volumes = _delete_storage_volumes(module, ecl2, [storage], snapshot)
 
         #
         # 仮想ストレージの削除
         #
-        _delete_storage_by_name(ecl2, name)
+        job = _delete_storage(module, ecl2, storage, snapshot)
 
         #
         # 正常終了
         #
-        module.exit_json(changed=True)
+        ecl2_exit_json(module, changed=True, id=storage['id'], job=job, volumes=volumes)
         return True
 
 #
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.openstack import openstack_module_kwargs
+from ansible.module_utils.ecl2 import HAS_ECLSDK, ecl2_argument_spec, ecl2_connection_from_module, ecl2_exit_json, ecl2_fail_json, ecl2_run
+from ansible.module_utils.ecl2 import Ecl2Waiter, ecl2_job, ecl2_plan, ecl2_snapshot_from_module, run_concurrently
+from ansible.module_utils.ecl2 import STORAGE_VOLUME_TYPE_ID, VOLUME_DEFAULT_IOPS_PER_GB, VOLUME_DEFAULT_SIZE, VOLUME_SIZES, VOLUME_IOPS_PER_GB
+import time
+
+#
+# 結果に含めない項目 (内部で使用する)
+#
+INTERNAL_KEYS = ['args', 'depends', 'storage_ref', 'record']
+
+#
+# ボリュームの指定の入力チェック (省略された項目は既定値)
+#
+def _volume_item(module, storage_name, item):
+    if not isinstance(item, dict) or item.get('name') == None:
+        ecl2_fail_json(module, msg='Each item of volumes in storage(%s) must be a dict with name field.' %(storage_name))
+    volume = {
+        'name'              : item['name'],
+        'state'             : item.get('state', 'present'),
+        'size'              : int(item.get('size', VOLUME_DEFAULT_SIZE)),
+        'iops_per_gb'       : str(item.get('iops_per_gb', VOLUME_DEFAULT_IOPS_PER_GB)),
+        'initiator_iqns'    : item.get('initiator_iqns', []),
+        'availability_zone' : item.get('availability_zone')
+    }
+    if not volume['size'] in VOLUME_SIZES:
+        ecl2_fail_json(module, msg='size of volume(%s) must be one of %s.' %(volume['name'], VOLUME_SIZES))
+    if not volume['iops_per_gb'] in VOLUME_IOPS_PER_GB:
+        ecl2_fail_json(module, msg='iops_per_gb of volume(%s) must be one of %s.' %(volume['name'], VOLUME_IOPS_PER_GB))
+    if not volume['state'] in ['absent', 'present']:
+        ecl2_fail_json(module, msg='state of volume(%s) must be present or absent.' %(volume['name']))
+    return volume
+
+#
+# 仮想ストレージの指定の入力チェック
+#
+def _storage_items(module):
+    storages = []
+    for item in module.params['storages']:
+        if not isinstance(item, dict) or item.get('name') == None:
+            ecl2_fail_json(module, msg='Each item of storages must be a dict with name field.')
+        storage = {
+            'name'                  : item['name'],
+            'state'                 : item.get('state', 'present'),
+            'subnet'                : item.get('subnet'),
+            'ip_addr_pool_start'    : item.get('ip_addr_pool_start'),
+            'ip_addr_pool_end'      : item.get('ip_addr_pool_end'),
+            'volumes'               : [_volume_item(module, item['name'], volume) for volume in item.get('volumes') or []]
+        }
+        if not storage['state'] in ['absent', 'present']:
+            ecl2_fail_json(module, msg='state of storage(%s) must be present or absent.' %(storage['name']))
+        volume_names = [volume['name'] for volume in storage['volumes']]
+        duplicated = sorted(set([name for name in volume_names if volume_names.count(name) > 1]))
+        if len(duplicated) > 0:
+            ecl2_fail_json(module, msg='Name of volumes in storage(%s) is duplicated: %s' %(storage['name'], ', '.join(duplicated)))
+        storages.append(storage)
+
+    names = [storage['name'] for storage in storages]
+    duplicated = sorted(set([name for name in names if names.count(name) > 1]))
+    if len(duplicated) > 0:
+        ecl2_fail_json(module, msg='Name of storages is duplicated: %s' %(', '.join(duplicated)))
+    return storages
+
+#
+# 仮想ストレージ作成時の引数を取得
+#
+def _storage_args(module, snapshot, storage):
+    if storage['subnet'] == None:
+        ecl2_fail_json(module, msg='Please input subnet field of storage(%s).' %(storage['name']))
+    if storage['ip_addr_pool_start'] == None or storage['ip_addr_pool_end'] == None:
+        ecl2_fail_json(module, msg='Please check ip_addr_pool_start & ip_addr_pool_end field of storage(%s).' %(storage['name']))
+    subnet = snapshot.find('subnet', storage['subnet'])
+    if subnet == None:
+        ecl2_fail_json(module, msg='Network subnet(%s) is not exist.' %(storage['subnet']))
+    return {
+        'name'              : storage['name'],
+        'network_id'        : subnet['network_id'],
+        'subnet_id'         : subnet['id'],
+        'volume_type_id'    : STORAGE_VOLUME_TYPE_ID,
+        'ip_addr_pool'      : {
+            'start' : storage['ip_addr_pool_start'],
+            'end'   : storage['ip_addr_pool_end']
+        }
+    }
+
+#
+# 処理 (作成 / 削除) の定義
+#
+def _action(action, kind, name, storage_name=None, record=None, args=None, depends=None, storage_ref=None):
+    return {
+        'action'        : action,
+        'kind'          : kind,
+        'name'          : name,
+        'storage'       : storage_name,
+        'id'            : None if record == None else record['id'],
+        'record'        : record,
+        'args'          : args,
+        'depends'       : depends or [],
+        'storage_ref'   : storage_ref,
+        'result'        : 'planned'
+    }
+
+#
+# 仮想ストレージの削除 (先にボリュームを全て削除する)
+#
+def _delete_storage_actions(storage_name, live, live_volumes):
+    volume_actions = [_action('delete', 'volume', volume['name'], storage_name, record=volume)
+                      for volume in live_volumes.values()]
+    return volume_actions + [_action('delete', 'storage', storage_name, record=live, depends=volume_actions)]
+
+#
+# 現在の状態と比較し、必要な処理を決める
+#
+# - 一覧は仮想ストレージ / ボリューム それぞれ1回だけ取得し、
+#   仮想ストレージは名前、ボリュームは (仮想ストレージID, 名前) で引けるようにする
+# - 新しい仮想ストレージのボリュームは仮想ストレージの作成完了後に作成する
+# - 仮想ストレージはボリュームの削除完了後に削除する
+#
+def _plan(module, snapshot, storages):
+    purge = module.params['purge']
+
+    live_storages = {}
+    for record in snapshot.list('storage'):
+        if record['name'] in live_storages:
+            ecl2_fail_json(module, msg='Name of storage(%s) is duplicated: %s, %s'
+                                   %(record['name'], live_storages[record['name']]['id'], record['id']))
+        live_storages[record['name']] = record
+
+    live_volumes = {}
+    for record in snapshot.list('volume'):
+        volumes = live_volumes.setdefault(record.get('virtual_storage_id'), {})
+        if record['name'] in volumes:
+            ecl2_fail_json(module, msg='Name of volume(%s) is duplicated: %s, %s'
+                                   %(record['name'], volumes[record['name']]['id'], record['id']))
+        volumes[record['name']] = record
+
+    actions = []
+    for storage in storages:
+        live = live_storages.get(storage['name'])
+        existing_volumes = {}
+        if not live == None:
+            existing_volumes = live_volumes.get(live['id'], {})
+
+        #
+        # 削除する仮想ストレージ
+        #
+        if storage['state'] == 'absent':
+            if not live == None:
+                actions.extend(_delete_storage_actions(storage['name'], live, existing_volumes))
+            continue
+
+        #
+        # 作成する仮想ストレージ
+        #
+        storage_ref = live
+        if live == None:
+            storage_ref = _action('create', 'storage', storage['name'], args=_storage_args(module, snapshot, storage))
+            actions.append(storage_ref)
+
+        #
+        # ボリューム
+        #
+        for volume in storage['volumes']:
+            live_volume = existing_volumes.get(volume['name'])
+            if volume['state'] == 'present' and live_volume == None:
+                args = dict([(key, volume[key]) for key in ['name', 'size', 'iops_per_gb', 'initiator_iqns', 'availability_zone']])
+                depends = [] if storage_ref is live else [storage_ref]
+                actions.append(_action('create', 'volume', volume['name'], storage['name'], args=args,
+                                       depends=depends, storage_ref=storage_ref))
+            elif volume['state'] == 'absent' and not live_volume == None:
+                actions.append(_action('delete', 'volume', volume['name'], storage['name'], record=live_volume))
+
+        #
+        # 指定されていないボリューム (purge=yes の場合は削除)
+        #
+        if purge:
+            listed = set([volume['name'] for volume in storage['volumes']])
+            for name, live_volume in sorted(existing_volumes.items()):
+                if not name in listed:
+                    actions.append(_action('delete', 'volume', name, storage['name'], record=live_volume))
+
+    #
+    # 指定されていない仮想ストレージ (purge=yes の場合は削除)
+    #
+    if purge:
+        listed = set([storage['name'] for storage in storages])
+        for name, live in sorted(live_storages.items()):
+            if not name in listed:
+                actions.extend(_delete_storage_actions(name, live, live_volumes.get(live['id'], {})))
+    return actions
+
+#
+# 処理の実行 (ワーカースレッドで実行)
+#
+def _run_action(cloud_ecl2, action):
+    if action['action'] == 'create':
+        if action['kind'] == 'storage':
+            return cloud_ecl2.storage.create_storage(**action['args']).to_dict()
+        args = dict(action['args'], virtual_storage_id=action['storage_ref']['id'])
+        return cloud_ecl2.storage.create_volume(**args).to_dict()
+    if action['kind'] == 'storage':
+        cloud_ecl2.storage.delete_storage(action['id'])
+    else:
+        cloud_ecl2.storage.delete_volume(action['id'])
+    return action['record']
+
+#
+# 処理の完了を待機 (仮想ストレージ / ボリューム 毎に1つの Waiter で並列に待つ)
+#
+def _wait_actions(cloud_ecl2, actions, deadline):
+    waiters = {}
+    for action in actions:
+        if not action['kind'] in waiters:
+            waiters[action['kind']] = Ecl2Waiter(cloud_ecl2, action['kind'], max(0, deadline - time.time()))
+        waiters[action['kind']].add(action['id'], 'available' if action['action'] == 'create' else 'deleted')
+
+    waits = {}
+    for results, error in run_concurrently(lambda waiter: waiter.wait(), list(waiters.values())):
+        if not error == None:
+            raise error
+        waits.update(results)
+
+    for action in actions:
+        wait_result = waits[action['id']]
+        action['result'] = wait_result['result']
+        action['status'] = wait_result['status']
+        action['elapsed'] = wait_result['elapsed']
+        if not wait_result['result'] == 'converged':
+            action['msg'] = '%s(%s) did not become %s (status: %s)' %(action['kind'], action['name'],
+                                                                      wait_result['target'], wait_result['status'])
+
+#
+# 処理を依存関係の順に並列で実行
+#
+# - 依存する処理が完了した処理から並列に実行する
+# - 他の処理が依存している処理は、その場で完了を待機する
+# - 依存する処理が失敗した処理は実行しない
+#
+def _apply(module, cloud_ecl2, snapshot, actions):
+    wait = module.params['wait']
+    timeout = int(module.params['timeout'])
+    max_concurrency = module.params['max_concurrency']
+    deadline = time.time() + timeout
+
+    depended = set()
+    for action in actions:
+        for dependency in action['depends']:
+            depended.add(id(dependency))
+
+    pending = list(actions)
+    while len(pending) > 0:
+        ready = []
+        waiting = []
+        for action in pending:
+            results = [dependency['result'] for dependency in action['depends']]
+            if any(not result in ['planned', 'submitted', 'converged'] for result in results):
+                action['result'] = 'skipped'
+                action['msg'] = 'Dependency of %s(%s) failed.' %(action['kind'], action['name'])
+            elif all(result == 'converged' for result in results):
+                ready.append(action)
+            else:
+                waiting.append(action)
+        if len(ready) == 0:
+            break
+
+        #
+        # 実行
+        #
+        outcomes = run_concurrently(lambda action: _run_action(cloud_ecl2, action), ready, max_concurrency)
+        for action, (record, error) in zip(ready, outcomes):
+            if not error == None:
+                action['result'] = 'failed'
+                action['msg'] = str(error)
+                continue
+            action['id'] = record['id']
+            action['result'] = 'submitted'
+            if action['action'] == 'create':
+                snapshot.created(action['kind'], record)
+                action['job'] = ecl2_job(action['kind'], record, 'available', timeout)
+            else:
+                snapshot.deleted(action['kind'], record['id'])
+                action['job'] = ecl2_job(action['kind'], record, 'deleted', timeout)
+
+        #
+        # 他の処理が依存しているものは完了を待機
+        #
+        blocking = [action for action in ready if action['result'] == 'submitted' and id(action) in depended]
+        if len(blocking) > 0:
+            _wait_actions(cloud_ecl2, blocking, deadline)
+        pending = waiting
+
+    #
+    # 残りの処理の完了を待機
+    #
+    if wait == True:
+        submitted = [action for action in actions if action['result'] == 'submitted']
+        if len(submitted) > 0:
+            _wait_actions(cloud_ecl2, submitted, deadline)
+
+#
+# 結果の作成 (内部で使用する項目を除く)
+#
+def _action_results(actions):
+    return [dict([(key, value) for key, value in action.items() if not key in INTERNAL_KEYS]) for action in actions]
+
+#
+# ストレージサービス: 仮想ストレージ / ボリューム の構成をまとめて反映
+#
+def main():
+    #
+    # Open Stack 共通引数取得
+    # - storages        : 仮想ストレージ (name / state / subnet / ip_addr_pool_start / ip_addr_pool_end / volumes) のリスト
+    #                     volumes は ボリューム (name / state / size / iops_per_gb / initiator_iqns / availability_zone) のリスト
+    # - purge           : 指定されていない仮想ストレージ / ボリューム を削除する
+    # - max_concurrency : 並列に実行する数
+    #
+    argument_spec = ecl2_argument_spec(
+        storages=dict(required=True, type='list'),
+        purge=dict(default=False, type='bool'),
+        max_concurrency=dict(default=10, type='int')
+    )
+    module_kwargs = openstack_module_kwargs()
+
+    #
+    # Ansible Module の 定義
+    #
+    module = AnsibleModule(
+        argument_spec = argument_spec,
+        supports_check_mode = True,
+        **module_kwargs
+    )
+
+    #
+    # モジュールの本体の実行 (サーキットブレーカーが遮断中の場合は異常終了とする)
+    #
+    return ecl2_run(module, _run)
+
+#
+# モジュールの本体
+#
+def _run(module):
+    storages = _storage_items(module)
+
+    #
+    # ECLSDKがインストールされているかの確認
+    #
+    if HAS_ECLSDK == False:
+        ecl2_fail_json(module, msg='ECLSDK is not exist.')
+
+    #
+    # ECLへの接続 (保存したスナップショットから計画する場合は接続しない)
+    #
+    ecl2 = None
+    if module.params['plan_snapshot'] == None:
+        ecl2 = ecl2_connection_from_module(module)
+    snapshot = ecl2_snapshot_from_module(module, ecl2, details=True)
+
+    #
+    # 必要な処理を決める
+    #
+    actions = _plan(module, snapshot, storages)
+    changed = len(actions) > 0
+
+    #
+    # チェックモードの場合は実行しない
+    #
+    if module.check_mode:
+        diff = [ecl2_plan(action['kind'], action['name'], action['record'], action['args'])['diff'] for action in actions]
+        ecl2_exit_json(module, changed=changed, actions=_action_results(actions), diff=diff)
+        return True
+
+    _apply(module, ecl2, snapshot, actions)
+
+    results = _action_results(actions)
+    failed = [result for result in results if result['result'] in ['failed', 'timeout', 'skipped']]
+    changed = any(not result['result'] in ['planned', 'failed', 'skipped'] for result in results)
+    if len(failed) > 0:
+        ecl2_fail_json(module, msg='Failed to reconcile storages: %s'
+                               %(', '.join(['%s %s(%s)' %(result['action'], result['kind'], result['name']) for result in failed])),
+                               changed=changed, actions=results)
+
+    #
+    # 正常終了
+    #
+    jobs = [result['job'] for result in results if result['result'] == 'submitted']
+    ecl2_exit_json(module, changed=changed, actions=results, jobs=jobs)
+    return True
+
+#
+# Entry Point
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.openstack import openstack_module_kwargs
+from ansible.module_utils.ecl2 import HAS_ECLSDK, ecl2_argument_spec, ecl2_connection_from_module, ecl2_exit_json, ecl2_fail_json, ecl2_run
+from ansible.module_utils.ecl2 import ecl2_iter_resources, ecl2_save_snapshot
+
+#
+# 必要な項目だけを取り出す (fields が未指定の場合は全て)
+#
+def _project(resource_dict, fields):
+    if fields == None:
+        return dict(resource_dict)
+    projected = {}
+    for field in fields:
+        if field in resource_dict:
+            projected[field] = resource_dict[field]
+    return projected
+
+#
+# 仮想ストレージとボリュームの構成を取得
+#
+# - 一覧はページ毎に読み進め、各リソースは必要な項目だけを残して保持する
+# - ボリュームは virtual_storage_id で仮想ストレージに紐付ける
+# - ボリュームをアベイラビリティゾーン毎にまとめる
+#
+def _storage_topology(module, cloud_ecl2, resources=None):
+    fields = module.params['fields']
+
+    storages = []
+    storages_by_id = {}
+    for storage in ecl2_iter_resources(cloud_ecl2, 'storage', details=True):
+        storage_dict = storage.to_dict()
+        if not resources == None:
+            resources['storage'].append(storage_dict)
+        entry = _project(storage_dict, fields)
+        entry['volumes'] = []
+        storages.append(entry)
+        storages_by_id[storage_dict['id']] = entry
+
+    unattached = []
+    zones = {}
+    for volume in ecl2_iter_resources(cloud_ecl2, 'volume', details=True):
+        volume_dict = volume.to_dict()
+        if not resources == None:
+            resources['volume'].append(volume_dict)
+        entry = _project(volume_dict, fields)
+        storage = storages_by_id.get(volume_dict.get('virtual_storage_id'))
+        if storage == None:
+            unattached.append(entry)
+        else:
+            storage['volumes'].append(entry)
+        zone = volume_dict.get('availability_zone') or 'unknown'
+        zones.setdefault(zone, []).append(volume_dict['id'])
+
+    return {
+        'ecl2_storages'              : storages,
+        'ecl2_storage_zones'         : zones,
+        'ecl2_storage_unattached'    : unattached
+    }
+
+#
+# スナップショットの保存 (plan_snapshot でチェックモードの計画に使用する)
+#
+def _save_snapshot(module, cloud_ecl2, resources):
+    resources['subnet'] = [subnet.to_dict() for subnet in ecl2_iter_resources(cloud_ecl2, 'subnet')]
+    ecl2_save_snapshot(module.params['save_snapshot'], resources)
+
+#
+# ストレージサービス: 仮想ストレージ / ボリューム の構成情報の取得
+#
+def main():
+    #
+    # Open Stack 共通引数取得
+    # - fields          : 結果に含める項目 (未指定の場合は全て)
+    # - save_snapshot   : 仮想ストレージ / ボリューム / サブネット の一覧を保存するファイル
+    #
+    argument_spec = ecl2_argument_spec(
+        fields=dict(default=None, type='list'),
+        save_snapshot=dict(default=None, type='path')
+    )
+    module_kwargs = openstack_module_kwargs()
+
+    #
+    # Ansible Module の 定義
+    #
+    module = AnsibleModule(
+        argument_spec = argument_spec,
+        supports_check_mode = True,
+        **module_kwargs
+    )
+
+    #
+    # モジュールの本体の実行 (サーキットブレーカーが遮断中の場合は異常終了とする)
+    #
+    return ecl2_run(module, _run)
+
+#
+# モジュールの本体
+#
+def _run(module):
+    #
+    # ECLSDKがインストールされているかの確認
+    #
+    if HAS_ECLSDK == False:
+        ecl2_fail_json(module, msg='ECLSDK is not exist.')
+
+    #
+    # ECLへの接続
+    #
+    ecl2 = ecl2_connection_from_module(module)
+
+    #
+    # 構成情報の取得 (保存する場合は一覧も保持する)
+    #
+    resources = None
+    if not module.params['save_snapshot'] == None:
+        resources = {'storage': [], 'volume': []}
+    facts = _storage_topology(module, ecl2, resources)
+    if not resources == None:
+        _save_snapshot(module, ecl2, resources)
+
+    #
+    # 正常終了
+    #
+    ecl2_exit_json(module, ansible_facts=facts, changed=False)
+    return True
+
+#
+# Entry Point
+#
+if __name__ == '__main__':
+    main()
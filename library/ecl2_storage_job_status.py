@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.openstack import openstack_module_kwargs
+from ansible.module_utils.ecl2 import HAS_ECLSDK, ecl2_argument_spec, ecl2_connection_from_module, ecl2_exit_json, ecl2_fail_json, ecl2_run
+from ansible.module_utils.ecl2 import ecl2_check_jobs
+
+#
+# ジョブの入力チェック
+#
+def _validate_jobs(module, jobs):
+    for job in jobs:
+        if not isinstance(job, dict):
+            ecl2_fail_json(module, msg='Each item of jobs must be a job returned by ecl2_storage or ecl2_storage_volume.')
+        for key in ['kind', 'id', 'target', 'deadline']:
+            if job.get(key) == None:
+                ecl2_fail_json(module, msg='Job is missing %s field: %s' %(key, job))
+        if not job['kind'] in ['storage', 'volume']:
+            ecl2_fail_json(module, msg='Kind of job must be storage or volume: %s' %(job))
+
+#
+# ストレージサービス: 非同期処理のジョブの状態確認
+#
+def main():
+    #
+    # Open Stack 共通引数取得
+    # - jobs            : ecl2_storage / ecl2_storage_volume が返したジョブ (job / jobs) のリスト
+    # - fail_on_error   : 失敗 / 期限切れ のジョブがある場合にエラーとする
+    #
+    argument_spec = ecl2_argument_spec(
+        jobs=dict(required=True, type='list'),
+        fail_on_error=dict(default=True, type='bool')
+    )
+    module_kwargs = openstack_module_kwargs()
+
+    #
+    # Ansible Module の 定義
+    #
+    module = AnsibleModule(
+        argument_spec = argument_spec,
+        supports_check_mode = True,
+        **module_kwargs
+    )
+
+    #
+    # モジュールの本体の実行 (サーキットブレーカーが遮断中の場合は異常終了とする)
+    #
+    return ecl2_run(module, _run)
+
+#
+# モジュールの本体
+#
+def _run(module):
+    #
+    # Ansible引数の取得 (ジョブが無い要素は除く)
+    #
+    jobs = [job for job in module.params['jobs'] if job]
+    fail_on_error = module.params['fail_on_error']
+    _validate_jobs(module, jobs)
+
+    #
+    # ECLSDKがインストールされているかの確認
+    #
+    if HAS_ECLSDK == False:
+        ecl2_fail_json(module, msg='ECLSDK is not exist.')
+
+    #
+    # ECLへの接続
+    #
+    ecl2 = ecl2_connection_from_module(module)
+    results = ecl2_check_jobs(ecl2, jobs)
+
+    #
+    # 集計
+    #
+    pending = [job for job in results if job['result'] == 'pending']
+    errors = [job for job in results if job['result'] in ['failed', 'timeout']]
+    done = len(pending) == 0
+
+    if fail_on_error and len(errors) > 0:
+        ecl2_fail_json(module, msg='Jobs failed: %s' %(', '.join(['%s(%s): %s' %(job['kind'], job['id'], job['status']) for job in errors])),
+                               jobs=results, done=done, pending=len(pending))
+
+    #
+    # 正常終了
+    #
+    ecl2_exit_json(module, jobs=results, done=done, pending=len(pending), errors=len(errors), changed=False)
+    return True
+
+#
+# Entry Point
+#
+if __name__ == '__main__':
+    main()
@@ -1,119 +1,106 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
-
-try:
-    import ecl as eclsdk
-    HAS_ECLSDK=True
-except:
-    HAS_ECLSDK=False
+from ansible.module_utils.openstack import openstack_module_kwargs
+from ansible.module_utils.ecl2 import HAS_ECLSDK, ecl2_argument_spec, ecl2_connection_from_module, ecl2_exit_json, ecl2_fail_json, ecl2_run
+from ansible.module_utils.ecl2 import Ecl2Waiter, ecl2_delete_resources, ecl2_job, ecl2_name_pattern, ecl2_plan, ecl2_snapshot_from_module, ecl2_wait_error, run_concurrently
+from ansible.module_utils.ecl2 import DELETING_STATUSES, VOLUME_SIZES, VOLUME_IOPS_PER_GB, VOLUME_DEFAULT_SIZE, VOLUME_DEFAULT_IOPS_PER_GB
 
 #
-# ECL接続
+# ボリューム作成時の引数を取得
 #
-def _get_ecl_connection_from_module(module):
-    try:
-        #
-        # モジュールから接続情報を取得するためのユーティリティを読み込み
-        #
-        from ansible.module_utils.openstack import openstack_cloud_from_module
-
-        #
-        # Cloud インスタンスの取得
-        #
-        sdk, cloud = openstack_cloud_from_module(module)
-    except:
-        #
-        # Clouds.yaml の 情報読み込み
-        #
-        import openstack
-        cloud_config = module.params['cloud']
-        cloud = openstack.connect(cloud=cloud_config)
-
+def _storage_volume_args(module, snapshot, params):
+    #
+    # 必要な引数の取得
     #
-    # 設定情報の取り出し
+    name = params['name']
+    size = params['size']
+    iops_per_gb = params['iops_per_gb']
+    initiator_iqns = params['initiator_iqns']
+    virtual_storage_name = params['virtual_storage']
+    availability_zone = params['availability_zone']
+
     #
-    # [参考]
-    # {
-    #   'username'          : 'API 鍵',
-    #   'password'          : 'API 秘密鍵',
-    #   'project_id'        : 'テナントID',
-    #   'user_domain_id'    : 'default',
-    #   'project_domain_id' : 'default',
-    #   'auth_url'          : '認証サーバURL'
-    # }
+    # ストレージの検索
     #
-    auth_args = cloud.config.get_auth_args()
+    storage = snapshot.find('storage', virtual_storage_name)
+    if storage == None:
+        ecl2_fail_json(module, msg='Virtual storage(%s) is not exist.' %(virtual_storage_name))
+        return False
 
     #
-    # 不要な項目はフィルタ
+    # 省略された項目は既定値
     #
-    ecl2_args = {
-        'username'          : auth_args['username'],
-        'password'          : auth_args['password'],
-        'project_id'        : auth_args['project_id'],
-        'user_domain_id'    : auth_args['user_domain_id'],
-        'project_domain_id' : auth_args['project_domain_id'],
-        'auth_url'          : auth_args['auth_url']
-    }
+    if size == None:
+        size = VOLUME_DEFAULT_SIZE
+    if iops_per_gb == None:
+        iops_per_gb = VOLUME_DEFAULT_IOPS_PER_GB
 
     #
-    # ECL2.0に接続する
+    # 引数の取得
     #
-    return eclsdk.connection.Connection(**ecl2_args)
+    return {
+        'name'                  : name,
+        'size'                  : int(size),        # サイズは整数値型でないとパラメータ不正が起こる
+        'iops_per_gb'           : str(iops_per_gb), # iopsは文字列型でないとパラメータ不正が起こる
+        'initiator_iqns'        : initiator_iqns or [],
+        'virtual_storage_id'    : storage['id'],
+        'availability_zone'     : availability_zone
+    }
 
 #
-# 仮想ストレージを名前で検索
+# 仮想ストレージ内にボリュームを作成
 #
-def _find_storage_by_name(cloud_ecl2, name):
-    for storage in cloud_ecl2.storage.storages(False):
-        storage_dict = storage.to_dict()
-        if storage_dict['name'] == name:
-            return storage_dict
-    return None
+def _create_storage_volume(module, cloud_ecl2, snapshot):
+    #
+    # 待機時間の取得
+    #
+    wait = module.params['wait']
+    timeout = int(module.params['timeout'])
 
-#
-# 仮想ストレージのボリュームを名前で検索
-#
-def _find_storage_volume_by_name(cloud_ecl2, name):
-    for volume in cloud_ecl2.storage.volumes(False):
-        volume_dict = volume.to_dict()
-        if volume_dict['name'] == name:
-            return volume_dict
-    return None
+    #
+    # 引数の取得
+    #
+    args = _storage_volume_args(module, snapshot, module.params)
 
-#
-# 仮想ネットワークの検索
-#
-def _find_network_by_name(cloud_ecl2, name):
-    for network in cloud_ecl2.network.networks():
-        network_dict = network.to_dict()
-        if network_dict['name'] == name:
-            return network_dict
-    return None
+    #
+    # ボリュームの作成
+    #
+    new_volume = cloud_ecl2.storage.create_volume(**args)
+    snapshot.created('volume', new_volume.to_dict())
+    job = ecl2_job('volume', new_volume.to_dict(), 'available', timeout)
+    if wait == True:
+        waiter = Ecl2Waiter(cloud_ecl2, 'volume', timeout)
+        waiter.add(new_volume.id)
+        error = ecl2_wait_error(waiter.wait())
+        if not error == None:
+            ecl2_fail_json(module, msg='Virtual storage volume(%s) is not available: %s' %(new_volume.name, error))
+            return None
+    return job
 
 #
-# 仮想サブネットの検索
+# 既存のボリュームとの差分
+#
+# - initiator_iqns は変更できる (指定されていない場合は比較しない)
+# - size / iops_per_gb は変更できないため、差分は drift として返す (指定されていない場合は比較しない)
 #
-def _find_network_subnet_by_name(cloud_ecl2, name):
-    for subnet in cloud_ecl2.network.subnets():
-        subnet_dict = subnet.to_dict()
-        if subnet_dict['name'] == name:
-            return subnet_dict
-    return None
+def _storage_volume_changes(volume, params):
+    updates = {}
+    if not params['initiator_iqns'] == None and not sorted(volume.get('initiator_iqns') or []) == sorted(params['initiator_iqns']):
+        updates['initiator_iqns'] = params['initiator_iqns']
+
+    drift = {}
+    if not params['size'] == None and not volume.get('size') == None and not int(volume['size']) == int(params['size']):
+        drift['size'] = {'current': int(volume['size']), 'requested': int(params['size'])}
+    if not params['iops_per_gb'] == None and not volume.get('iops_per_gb') == None \
+            and not str(volume['iops_per_gb']) == str(params['iops_per_gb']):
+        drift['iops_per_gb'] = {'current': str(volume['iops_per_gb']), 'requested': str(params['iops_per_gb'])}
+    return updates, drift
 
 #
-# 仮想ストレージの作成
+# 既存のボリュームを変更
 #
-def _create_storage(module, cloud_ecl2):
-    #
-    # 必要な引数の取得
-    #
-    name = module.params['name']
-    subnet_name = module.params['subnet']
-    ip_addr_pool_start = module.params['ip_addr_pool_start']
-    ip_addr_pool_end = module.params['ip_addr_pool_end']
+def _update_storage_volume(module, cloud_ecl2, volume, updates):
     #
     # 待機時間の取得
     #
@@ -121,127 +108,225 @@ def _create_storage(module, cloud_ecl2):
     timeout = int(module.params['timeout'])
 
     #
-    # サブネットの入力チェック
-    #
-    if subnet_name == None:
-        module.fail_json(msg='Please input subnet field.')
-        return False
-
-    #
-    # サブネットの取得
-    #
-    subnet = _find_network_subnet_by_name(cloud_ecl2, subnet_name)
-    if subnet == None:
-        module.fail_json(msg='Network subnet(%s) is not exist.' %(subnet_name))
-        return False
-
-    #
-    # IPの確認
+    # ボリュームの変更
     #
-    if ip_addr_pool_start == None or ip_addr_pool_end == None:
-        module.fail_json(msg='Please check ip_addr_pool_start & ip_addr_pool_end field.')
-        return False
+    cloud_ecl2.storage.update_volume(volume['id'], **updates)
+    job = ecl2_job('volume', volume, 'available', timeout)
+    if wait == True:
+        waiter = Ecl2Waiter(cloud_ecl2, 'volume', timeout)
+        waiter.add(volume['id'])
+        error = ecl2_wait_error(waiter.wait())
+        if not error == None:
+            ecl2_fail_json(module, msg='Virtual storage volume(%s) is not available: %s' %(volume['name'], error), changed=True, job=job)
+            return None
+    return job
 
+#
+# 仮想ストレージ内のボリュームを削除
+#
+def _delete_storage_volume(module, cloud_ecl2, volume, snapshot):
     #
-    # 引数の取得
+    # 待機時間の取得
     #
-    args = {
-        'name' : name,
-        'network_id' : subnet['network_id'],
-        'subnet_id' : subnet['id'],
-        'volume_type_id' : '6328d234-7939-4d61-9216-736de66d15f9',
-        'ip_addr_pool' : {
-            'start' : ip_addr_pool_start,
-            'end'   : ip_addr_pool_end
-        }
-    }
+    wait = module.params['wait']
+    timeout = int(module.params['timeout'])
 
     #
-    # ストレージの作成
+    # ボリュームの削除
     #
-    new_storage = cloud_ecl2.storage.create_storage(**args)
+    volume_id = volume['id']
+    cloud_ecl2.storage.delete_volume(volume_id)
+    snapshot.deleted('volume', volume_id)
+    job = ecl2_job('volume', volume, 'deleted', timeout)
     if wait == True:
-        cloud_ecl2.storage.wait_for_status(new_storage, status='available', wait=timeout)
-    return True
+        waiter = Ecl2Waiter(cloud_ecl2, 'volume', timeout)
+        waiter.add(volume_id, 'deleted')
+        error = ecl2_wait_error(waiter.wait())
+        if not error == None:
+            ecl2_fail_json(module, msg='Virtual storage volume(%s) is not deleted: %s' %(volume['name'], error), changed=True, job=job)
+            return None
+    return job
 
 #
-# 仮想ストレージの削除
+# 一括指定されたボリュームの引数を取得 (省略された項目はモジュールの引数を使用)
 #
-def _delete_storage_by_name(cloud_ecl2, name):
-    # ストレージの検索
-    storage = _find_storage_by_name(cloud_ecl2, name)
-    if not storage == None:
-        # ストレージの削除
-        storage_id = storage['id']
-        cloud_ecl2.storage.delete_storage(storage_id)
-        return True
-    return False
+def _storage_volume_item(module, item):
+    if not isinstance(item, dict) or item.get('name') == None:
+        ecl2_fail_json(module, msg='Each item of volumes must be a dict with name field.')
+    params = {}
+    for key in ['name', 'size', 'iops_per_gb', 'initiator_iqns', 'virtual_storage', 'availability_zone', 'state']:
+        params[key] = item.get(key, module.params[key])
+    if not params['iops_per_gb'] == None:
+        params['iops_per_gb'] = str(params['iops_per_gb'])
+    if not params['size'] == None and not int(params['size']) in VOLUME_SIZES:
+        ecl2_fail_json(module, msg='size of volume(%s) must be one of %s.' %(params['name'], VOLUME_SIZES))
+    if not params['iops_per_gb'] == None and not params['iops_per_gb'] in VOLUME_IOPS_PER_GB:
+        ecl2_fail_json(module, msg='iops_per_gb of volume(%s) must be one of %s.' %(params['name'], VOLUME_IOPS_PER_GB))
+    if not params['state'] in ['absent', 'present']:
+        ecl2_fail_json(module, msg='state of volume(%s) must be present or absent.' %(params['name']))
+    return params
 
 #
-# 仮想ストレージ内にボリュームを作成
+# 一括指定されたボリュームの作成 / 変更 / 削除 (ワーカースレッドで実行)
 #
-def _create_storage_volume(module, cloud_ecl2):
-    #
-    # 必要な引数の取得
-    #
-    name = module.params['name']
-    size = module.params['size']
-    iops_per_gb = module.params['iops_per_gb']
-    initiator_iqns = module.params['initiator_iqns']
-    virtual_storage_name = module.params['virtual_storage']
-    availability_zone = module.params['availability_zone']
+def _run_storage_volume_task(cloud_ecl2, task):
+    if task['action'] == 'create':
+        new_volume = cloud_ecl2.storage.create_volume(**task['args'])
+        return new_volume.to_dict()
+    elif task['action'] == 'update':
+        cloud_ecl2.storage.update_volume(task['volume']['id'], **task['args'])
+        return task['volume']
+    else:
+        cloud_ecl2.storage.delete_volume(task['volume']['id'])
+        return task['volume']
+
+#
+# 複数のボリュームを一括で作成 / 削除
+#
+def _apply_storage_volumes(module, cloud_ecl2, snapshot):
     #
-    # 待機時間の取得
+    # 待機時間 / 並列数 の取得
     #
     wait = module.params['wait']
     timeout = int(module.params['timeout'])
+    max_concurrency = module.params['max_concurrency']
+
+    items = [_storage_volume_item(module, item) for item in module.params['volumes']]
+    names = [item['name'] for item in items]
+    duplicated = sorted(set([name for name in names if names.count(name) > 1]))
+    if len(duplicated) > 0:
+        ecl2_fail_json(module, msg='Name of volumes is duplicated: %s' %(', '.join(duplicated)))
+
+    #
+    # 一覧は1度だけ取得し、変更が必要なものを決める
+    #
+    snapshot.list('volume')
+    if any(item['state'] == 'present' for item in items):
+        snapshot.list('storage')
+
+    results = []
+    tasks = []
+    plans = []
+    for item in items:
+        volume = snapshot.find('volume', item['name'])
+        result = {'name': item['name'], 'state': item['state'], 'changed': False}
+        if item['state'] == 'present' and volume == None:
+            args = _storage_volume_args(module, snapshot, item)
+            tasks.append({'action': 'create', 'result': result, 'args': args})
+            plans.append(ecl2_plan('volume', item['name'], None, args))
+        elif item['state'] == 'absent' and not volume == None:
+            tasks.append({'action': 'delete', 'result': result, 'volume': volume})
+            plans.append(ecl2_plan('volume', item['name'], volume, None))
+        elif item['state'] == 'present':
+            updates, drift = _storage_volume_changes(volume, item)
+            result['id'] = volume['id']
+            if len(drift) > 0:
+                result['drift'] = drift
+            if len(updates) > 0:
+                tasks.append({'action': 'update', 'result': result, 'volume': volume, 'args': updates})
+            plans.append(ecl2_plan('volume', item['name'], volume, dict(volume, **updates)))
+        else:
+            if not volume == None:
+                result['id'] = volume['id']
+            plans.append(ecl2_plan('volume', item['name'], volume, volume))
+        results.append(result)
+
+    #
+    # チェックモードの場合は計画だけを返す
+    #
+    if module.check_mode:
+        for result, plan in zip(results, plans):
+            result['changed'] = not plan['action'] == 'none'
+            result['plan'] = plan
+        return results
+
+    #
+    # 作成 / 削除 を並列に実行
+    #
+    outcomes = run_concurrently(lambda task: _run_storage_volume_task(cloud_ecl2, task),
+                                tasks, max_concurrency)
+    waiter = Ecl2Waiter(cloud_ecl2, 'volume', timeout)
+    for task, (volume, error) in zip(tasks, outcomes):
+        result = task['result']
+        if not error == None:
+            result['failed'] = True
+            result['msg'] = str(error)
+            continue
+        result['changed'] = True
+        result['id'] = volume['id']
+        if task['action'] == 'create':
+            snapshot.created('volume', volume)
+            waiter.add(volume['id'])
+            result['job'] = ecl2_job('volume', volume, 'available', timeout)
+        elif task['action'] == 'update':
+            waiter.add(volume['id'])
+            result['updated'] = sorted(task['args'])
+            result['job'] = ecl2_job('volume', volume, 'available', timeout)
+        else:
+            snapshot.deleted('volume', volume['id'])
+            waiter.add(volume['id'], 'deleted')
+            result['job'] = ecl2_job('volume', volume, 'deleted', timeout)
+
+    #
+    # 作成 / 削除 したボリュームの完了をまとめて待機
+    #
+    if wait == True and len(waiter.targets) > 0:
+        waits = waiter.wait()
+        for result in results:
+            if result.get('id') in waits:
+                wait_result = waits[result['id']]
+                result['status'] = wait_result['status']
+                result['elapsed'] = wait_result['elapsed']
+                error = ecl2_wait_error({result['id']: wait_result})
+                if not error == None:
+                    result['failed'] = True
+                    result['msg'] = error
+    return results
 
-    #
-    # ストレージの検索
-    #
-    storage = _find_storage_by_name(cloud_ecl2, virtual_storage_name)
-    if storage == None:
-        module.fail_json(msg='Virtual storage(%s) is not exist.' %(virtual_storage_name))
-        return False
+#
+# 名前のパターンに一致するボリュームを一括で削除
+#
+# - 1回の一覧取得で一致するものを決め、削除中のものは削除しない
+# - 削除する数が max_deletes を超える場合は何も削除せずにエラーとする
+#
+def _delete_storage_volumes_by_pattern(module, cloud_ecl2, snapshot):
+    pattern = module.params['name_pattern']
+    max_deletes = module.params['max_deletes']
 
-    #
-    # 引数の取得
-    #
-    args = {
-        'name'                  : name,
-        'size'                  : int(size),        # サイズは整数値型でないとパラメータ不正が起こる
-        'iops_per_gb'           : str(iops_per_gb), # iopsは文字列型でないとパラメータ不正が起こる
-        'initiator_iqns'        : initiator_iqns,
-        'virtual_storage_id'    : storage['id'],
-        'availability_zone'     : availability_zone
-    }
+    if not module.params['state'] == 'absent':
+        ecl2_fail_json(module, msg='name_pattern can only be used with state=absent.')
+
+    match = ecl2_name_pattern(module)
+    volumes = [volume for volume in snapshot.list('volume') if match(volume['name'])]
+    deletable = [volume for volume in volumes if not volume.get('status') in DELETING_STATUSES]
+    if not max_deletes == None and len(deletable) > max_deletes:
+        ecl2_fail_json(module, msg='name_pattern(%s) matched %d volumes, more than max_deletes(%d).'
+                               %(pattern, len(deletable), max_deletes), names=[volume['name'] for volume in deletable])
 
     #
-    # ボリュームの作成
+    # チェックモードの場合は計画だけを返す
     #
-    new_volume = cloud_ecl2.storage.create_volume(**args)
-    if wait == True:
-        cloud_ecl2.storage.wait_for_status(new_volume, status='available', wait=timeout)
-    return True
+    if module.check_mode:
+        plans = [ecl2_plan('volume', volume['name'], volume, None) for volume in deletable]
+        ecl2_exit_json(module, changed=len(plans) > 0, plans=plans, diff=[plan['diff'] for plan in plans])
+        return True
 
-#
-# 仮想ストレージ内のボリュームを削除
-#
-def _delete_storage_volume_by_name(module, cloud_ecl2):
     #
-    # 必要な引数の取得
+    # 削除を並列に実行
     #
-    name = module.params['name']
+    results = ecl2_delete_resources(cloud_ecl2, snapshot, 'volume', volumes, module.params['max_concurrency'],
+                                    int(module.params['timeout']), module.params['wait'])
+    changed = any(result['changed'] for result in results)
+    failed = [result['name'] for result in results if result.get('failed')]
+    if len(failed) > 0:
+        ecl2_fail_json(module, msg='Failed to delete volumes: %s' %(', '.join(failed)), changed=changed, results=results)
 
     #
-    # ボリュームの検索
+    # 正常終了
     #
-    volume = _find_storage_volume_by_name(cloud_ecl2, name)
-    if not volume == None:
-        # ボリュームの削除
-        volume_id = volume['id']
-        cloud_ecl2.storage.delete_volume(volume_id)
-    return False
+    jobs = [result['job'] for result in results if 'job' in result]
+    ecl2_exit_json(module, changed=changed, results=results, jobs=jobs)
+    return True
 
 #
 # ストレージサービス: ブロックストレージの作成
@@ -250,16 +335,25 @@ def main():
     #
     # Open Stack 共通引数取得
     #
-    argument_spec = openstack_full_argument_spec(
-        name=dict(required=True),
-        size=dict(default=100, type='int', choices=[100, 250, 500, 1000, 2000, 4000, 8000, 12000]),
-        iops_per_gb=dict(default='2', choices=['2', '4']),
-        initiator_iqns=dict(default=[], type='list'),
+    argument_spec = ecl2_argument_spec(
+        name=dict(required=False),
+        id=dict(required=False),
+        size=dict(default=None, type='int', choices=VOLUME_SIZES),
+        iops_per_gb=dict(default=None, choices=VOLUME_IOPS_PER_GB),
+        initiator_iqns=dict(default=None, type='list'),
         virtual_storage=dict(required=False),
         availability_zone=dict(required=False),
-        state=dict(default='present', choices=['absent', 'present'])
+        state=dict(default='present', choices=['absent', 'present']),
+        volumes=dict(default=None, type='list'),
+        name_pattern=dict(required=False),
+        pattern_type=dict(default='glob', choices=['glob', 'regex']),
+        max_deletes=dict(default=None, type='int'),
+        max_concurrency=dict(default=10, type='int')
+    )
+    module_kwargs = openstack_module_kwargs(
+        required_one_of=[['name', 'id', 'volumes', 'name_pattern']],
+        mutually_exclusive=[['name', 'volumes', 'name_pattern'], ['id', 'volumes', 'name_pattern']]
     )
-    module_kwargs = openstack_module_kwargs()
 
     #
     # Ansible Module の 定義
@@ -270,60 +364,133 @@ def main():
         **module_kwargs
     )
 
+    #
+    # モジュールの本体の実行 (サーキットブレーカーが遮断中の場合は異常終了とする)
+    #
+    return ecl2_run(module, _run)
+
+#
+# モジュールの本体
+#
+def _run(module):
     #
     # Ansible引数の取得
     #
     name = module.params['name']
+    volume_id = module.params['id']
     state = module.params['state']
 
     #
     # ECLSDKがインストールされているかの確認
     #
     if HAS_ECLSDK == False:
-        module.fail_json(msg='ECLSDK is not exist.')
+        ecl2_fail_json(module, msg='ECLSDK is not exist.')
 
     #
-    # ECLへの接続
+    # ECLへの接続 (保存したスナップショットから計画する場合は接続しない)
     #
-    ecl2 = _get_ecl_connection_from_module(module)
-    volume = _find_storage_volume_by_name(ecl2, name)
+    ecl2 = None
+    if module.params['plan_snapshot'] == None:
+        ecl2 = ecl2_connection_from_module(module)
+    # (既存のボリュームと比較する / 状態を参照する ため、削除以外と name_pattern の場合は詳細の一覧を取得する)
+    details = not state == 'absent' or not module.params['volumes'] == None or not module.params['name_pattern'] == None
+    snapshot = ecl2_snapshot_from_module(module, ecl2, details=details)
+
+    #
+    # 名前のパターンで一括削除する場合
+    #
+    if not module.params['name_pattern'] == None:
+        return _delete_storage_volumes_by_pattern(module, ecl2, snapshot)
+
+    #
+    # 複数のボリュームを一括で指定した場合
+    #
+    if not module.params['volumes'] == None:
+        results = _apply_storage_volumes(module, ecl2, snapshot)
+        changed = any(result['changed'] for result in results)
+        failed = [result['name'] for result in results if result.get('failed')]
+        if len(failed) > 0:
+            ecl2_fail_json(module, msg='Failed to apply volumes: %s' %(', '.join(failed)), changed=changed, results=results)
+        if module.check_mode:
+            ecl2_exit_json(module, changed=changed, results=results, diff=[result['plan']['diff'] for result in results])
+            return True
+        jobs = [result['job'] for result in results if 'job' in result]
+        ecl2_exit_json(module, changed=changed, results=results, jobs=jobs)
+        return True
+
+    #
+    # ボリュームの検索 (ID が指定された場合は ID で取得)
+    #
+    if not volume_id == None:
+        volume = snapshot.get('volume', volume_id)
+        name = volume_id if volume == None else volume['name']
+    else:
+        volume = snapshot.find('volume', name)
+
+    #
+    # チェックモードの場合は計画だけを返す
+    #
+    if module.check_mode:
+        after = None
+        drift = {}
+        if state == 'present':
+            if volume == None and not volume_id == None:
+                ecl2_fail_json(module, msg='Virtual storage volume(%s) is not exist.' %(volume_id))
+            if volume == None:
+                after = _storage_volume_args(module, snapshot, module.params)
+            else:
+                updates, drift = _storage_volume_changes(volume, module.params)
+                after = dict(volume, **updates)
+        plan = ecl2_plan('volume', name, volume, after)
+        ecl2_exit_json(module, changed=not plan['action'] == 'none', id=plan['id'], plan=plan, drift=drift, diff=plan['diff'])
+        return True
 
     #
     # 仮想ストレージの作成
     #
     if state == 'present':
         #
-        # 既に仮想ボリュームが存在する場合
+        # 既に仮想ボリュームが存在する場合 (変更できる項目に差分があれば変更する)
         #
         if not volume == None:
-            module.exit_json(msg = 'Virtual storage volume(%s) is already exist.' %(name), changed=False)
+            updates, drift = _storage_volume_changes(volume, module.params)
+            if len(updates) == 0:
+                ecl2_exit_json(module, msg = 'Virtual storage volume(%s) is already exist.' %(name), changed=False, id=volume['id'], drift=drift)
+            job = _update_storage_volume(module, ecl2, volume, updates)
+            ecl2_exit_json(module, changed=True, id=volume['id'], job=job, updated=sorted(updates), drift=drift)
+
+        #
+        # ID が指定されたボリュームは作成できない
+        #
+        if not volume_id == None:
+            ecl2_fail_json(module, msg='Virtual storage volume(%s) is not exist.' %(volume_id))
 
         #
         # 仮想ストレージボリュームの作成
         #
-        _create_storage_volume(module, ecl2)
+        job = _create_storage_volume(module, ecl2, snapshot)
 
         #
         # 正常終了
         #
-        module.exit_json(changed=True)
+        ecl2_exit_json(module, changed=True, id=job['id'], job=job)
         return True
     else:
         #
         # 既に仮想ストレージが存在しない場合
         #
         if volume == None:
-            module.exit_json(msg = 'Virtual storage volume(%s) is not exist.' %(name), changed=False)
+            ecl2_exit_json(module, msg = 'Virtual storage volume(%s) is not exist.' %(name), changed=False, id=volume_id)
 
         #
         # 仮想ストレージボリュームの削除
         #
-        _delete_storage_volume_by_name(module, ecl2)
+        job = _delete_storage_volume(module, ecl2, volume, snapshot)
 
         #
         # 正常終了
         #
-        module.exit_json(changed=True)
+        ecl2_exit_json(module, changed=True, id=volume['id'], job=job)
         return True
 
 #
@@ -1,247 +1,75 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
-
-try:
-    import ecl as eclsdk
-    HAS_ECLSDK=True
-except:
-    HAS_ECLSDK=False
+from ansible.module_utils.openstack import openstack_module_kwargs
+from ansible.module_utils.ecl2 import HAS_ECLSDK, ecl2_argument_spec, ecl2_connection_from_module, ecl2_exit_json, ecl2_fail_json, ecl2_run
+from ansible.module_utils.ecl2 import ecl2_iter_resources, ecl2_name_index_from_module, ecl2_name_pattern, get_storage_volume
 
 #
-# ECL接続
+# 仮想ストレージのボリュームを名前で検索 (詳細情報)
 #
-def _get_ecl_connection_from_module(module):
-    try:
-        #
-        # モジュールから接続情報を取得するためのユーティリティを読み込み
-        #
-        from ansible.module_utils.openstack import openstack_cloud_from_module
-
-        #
-        # Cloud インスタンスの取得
-        #
-        sdk, cloud = openstack_cloud_from_module(module)
-    except:
-        #
-        # Clouds.yaml の 情報読み込み
-        #
-        import openstack
-        cloud_config = module.params['cloud']
-        cloud = openstack.connect(cloud=cloud_config)
-
-    #
-    # 設定情報の取り出し
-    #
-    # [参考]
-    # {
-    #   'username'          : 'API 鍵',
-    #   'password'          : 'API 秘密鍵',
-    #   'project_id'        : 'テナントID',
-    #   'user_domain_id'    : 'default',
-    #   'project_domain_id' : 'default',
-    #   'auth_url'          : '認証サーバURL'
-    # }
-    #
-    auth_args = cloud.config.get_auth_args()
-
+# 概要の一覧で ID を解決し、一致したボリュームだけ詳細を ID で取得する
+#
+def _find_storage_volume_detail_by_name(cloud_ecl2, name, index):
     #
-    # 不要な項目はフィルタ
+    # インデックスで ID を解決
     #
-    ecl2_args = {
-        'username'          : auth_args['username'],
-        'password'          : auth_args['password'],
-        'project_id'        : auth_args['project_id'],
-        'user_domain_id'    : auth_args['user_domain_id'],
-        'project_domain_id' : auth_args['project_domain_id'],
-        'auth_url'          : auth_args['auth_url']
-    }
+    if not index == None:
+        for volume in index.get('volume', name):
+            volume_detail = get_storage_volume(cloud_ecl2, volume['id'])
+            if not volume_detail == None:
+                return volume_detail
+            # インデックスが古い場合
+            index.forget('volume', volume['id'])
 
     #
-    # ECL2.0に接続する
+    # 概要の一覧をページ毎に読み進め、最初に一致した時点で打ち切る
     #
-    return eclsdk.connection.Connection(**ecl2_args)
-
-#
-# 仮想ストレージを名前で検索
-#
-def _find_storage_by_name(cloud_ecl2, name):
-    for storage in cloud_ecl2.storage.storages(True):
-        storage_dict = storage.to_dict()
-        if storage_dict['name'] == name:
-            return storage_dict
-    return None
-
-#
-# 仮想ストレージのボリュームを名前で検索
-#
-def _find_storage_volume_by_name(cloud_ecl2, name):
-    for volume in cloud_ecl2.storage.volumes(True):
+    for volume in ecl2_iter_resources(cloud_ecl2, 'volume', name=name):
         volume_dict = volume.to_dict()
         if volume_dict['name'] == name:
-            return volume_dict
-    return None
-
-#
-# 仮想ネットワークの検索
-#
-def _find_network_by_name(cloud_ecl2, name):
-    for network in cloud_ecl2.network.networks():
-        network_dict = network.to_dict()
-        if network_dict['name'] == name:
-            return network_dict
+            if not index == None:
+                index.put('volume', volume_dict)
+            return get_storage_volume(cloud_ecl2, volume_dict['id'])
     return None
 
 #
-# 仮想サブネットの検索
+# 名前の判定 (names に含まれるか、name_pattern に一致するか)
 #
-def _find_network_subnet_by_name(cloud_ecl2, name):
-    for subnet in cloud_ecl2.network.subnets():
-        subnet_dict = subnet.to_dict()
-        if subnet_dict['name'] == name:
-            return subnet_dict
-    return None
+def _name_matcher(module):
+    names = set(module.params['names'] or [])
+    if module.params['name_pattern'] == None:
+        return lambda name: name in names
+    match = ecl2_name_pattern(module)
+    return lambda name: name in names or match(name)
 
 #
-# 仮想ストレージの作成
+# 複数のボリュームを1回の一覧取得で検索 (名前 → 詳細情報)
 #
-def _create_storage(module, cloud_ecl2):
-    #
-    # 必要な引数の取得
-    #
-    name = module.params['name']
-    subnet_name = module.params['subnet']
-    ip_addr_pool_start = module.params['ip_addr_pool_start']
-    ip_addr_pool_end = module.params['ip_addr_pool_end']
-    #
-    # 待機時間の取得
-    #
-    wait = module.params['wait']
-    timeout = int(module.params['timeout'])
-
-    #
-    # サブネットの入力チェック
-    #
-    if subnet_name == None:
-        module.fail_json(msg='Please input subnet field.')
-        return False
+def _find_storage_volumes(module, cloud_ecl2):
+    names = module.params['names'] or []
+    match = _name_matcher(module)
+    volumes = {}
+    duplicated = []
 
-    #
-    # サブネットの取得
-    #
-    subnet = _find_network_subnet_by_name(cloud_ecl2, subnet_name)
-    if subnet == None:
-        module.fail_json(msg='Network subnet(%s) is not exist.' %(subnet_name))
-        return False
-
-    #
-    # IPの確認
-    #
-    if ip_addr_pool_start == None or ip_addr_pool_end == None:
-        module.fail_json(msg='Please check ip_addr_pool_start & ip_addr_pool_end field.')
-        return False
-
-    #
-    # 引数の取得
-    #
-    args = {
-        'name' : name,
-        'network_id' : subnet['network_id'],
-        'subnet_id' : subnet['id'],
-        'volume_type_id' : '6328d234-7939-4d61-9216-736de66d15f9',
-        'ip_addr_pool' : {
-            'start' : ip_addr_pool_start,
-            'end'   : ip_addr_pool_end
-        }
-    }
-
-    #
-    # ストレージの作成
-    #
-    new_storage = cloud_ecl2.storage.create_storage(**args)
-    if wait == True:
-        cloud_ecl2.storage.wait_for_status(new_storage, status='available', wait=timeout)
-    return True
-
-#
-# 仮想ストレージの削除
-#
-def _delete_storage_by_name(cloud_ecl2, name):
-    # ストレージの検索
-    storage = _find_storage_by_name(cloud_ecl2, name)
-    if not storage == None:
-        # ストレージの削除
-        storage_id = storage['id']
-        cloud_ecl2.storage.delete_storage(storage_id)
-        return True
-    return False
-
-#
-# 仮想ストレージ内にボリュームを作成
-#
-def _create_storage_volume(module, cloud_ecl2):
-    #
-    # 必要な引数の取得
-    #
-    name = module.params['name']
-    size = module.params['size']
-    iops_per_gb = module.params['iops_per_gb']
-    initiator_iqns = module.params['initiator_iqns']
-    virtual_storage_name = module.params['virtual_storage']
-    availability_zone = module.params['availability_zone']
-    #
-    # 待機時間の取得
-    #
-    wait = module.params['wait']
-    timeout = int(module.params['timeout'])
-
-    #
-    # ストレージの検索
-    #
-    storage = _find_storage_by_name(cloud_ecl2, virtual_storage_name)
-    if storage == None:
-        module.fail_json(msg='Virtual storage(%s) is not exist.' %(virtual_storage_name))
-        return False
-
-    #
-    # 引数の取得
-    #
-    args = {
-        'name'                  : name,
-        'size'                  : int(size),        # サイズは整数値型でないとパラメータ不正が起こる
-        'iops_per_gb'           : str(iops_per_gb), # iopsは文字列型でないとパラメータ不正が起こる
-        'initiator_iqns'        : initiator_iqns,
-        'virtual_storage_id'    : storage['id'],
-        'availability_zone'     : availability_zone
-    }
-
-    #
-    # ボリュームの作成
-    #
-    new_volume = cloud_ecl2.storage.create_volume(**args)
-    if wait == True:
-        cloud_ecl2.storage.wait_for_status(new_volume, status='available', wait=timeout)
-    return True
+    for volume in ecl2_iter_resources(cloud_ecl2, 'volume', details=True):
+        volume_dict = volume.to_dict()
+        name = volume_dict['name']
+        if not match(name):
+            continue
+        if name in volumes:
+            duplicated.append(name)
+            continue
+        volumes[name] = volume_dict
 
-#
-# 仮想ストレージ内のボリュームを削除
-#
-def _delete_storage_volume_by_name(module, cloud_ecl2):
-    #
-    # 必要な引数の取得
-    #
-    name = module.params['name']
+        #
+        # 名前だけを指定した場合は全て見つかった時点で打ち切る
+        #
+        if module.params['name_pattern'] == None and len(volumes) == len(set(names)):
+            break
 
-    #
-    # ボリュームの検索
-    #
-    volume = _find_storage_volume_by_name(cloud_ecl2, name)
-    if not volume == None:
-        # ボリュームの削除
-        volume_id = volume['id']
-        cloud_ecl2.storage.delete_volume(volume_id)
-    return False
+    missing = [name for name in names if not name in volumes]
+    return volumes, missing, sorted(set(duplicated))
 
 #
 # ストレージサービス: ブロックストレージの作成
@@ -250,10 +78,18 @@ def main():
     #
     # Open Stack 共通引数取得
     #
-    argument_spec = openstack_full_argument_spec(
-        name=dict(required=True)
+    argument_spec = ecl2_argument_spec(
+        name=dict(required=False),
+        id=dict(required=False),
+        names=dict(default=None, type='list'),
+        name_pattern=dict(required=False),
+        pattern_type=dict(default='glob', choices=['glob', 'regex']),
+        fail_on_missing=dict(default=True, type='bool')
+    )
+    module_kwargs = openstack_module_kwargs(
+        required_one_of=[['name', 'id', 'names', 'name_pattern']],
+        mutually_exclusive=[['name', 'names'], ['name', 'name_pattern'], ['id', 'names'], ['id', 'name_pattern']]
     )
-    module_kwargs = openstack_module_kwargs()
 
     #
     # Ansible Module の 定義
@@ -264,33 +100,62 @@ def main():
         **module_kwargs
     )
 
+    #
+    # モジュールの本体の実行 (サーキットブレーカーが遮断中の場合は異常終了とする)
+    #
+    return ecl2_run(module, _run)
+
+#
+# モジュールの本体
+#
+def _run(module):
     #
     # Ansible引数の取得
     #
     name = module.params['name']
+    volume_id = module.params['id']
 
     #
     # ECLSDKがインストールされているかの確認
     #
     if HAS_ECLSDK == False:
-        module.fail_json(msg='ECLSDK is not exist.')
+        ecl2_fail_json(module, msg='ECLSDK is not exist.')
 
     #
     # ECLへの接続
     #
-    ecl2 = _get_ecl_connection_from_module(module)
-    volume = _find_storage_volume_by_name(ecl2, name)
+    ecl2 = ecl2_connection_from_module(module)
+
+    #
+    # 複数のボリュームを指定した場合
+    #
+    if not module.params['names'] == None or not module.params['name_pattern'] == None:
+        volumes, missing, duplicated = _find_storage_volumes(module, ecl2)
+        if module.params['fail_on_missing'] and len(missing) > 0:
+            ecl2_fail_json(module, msg='Volume (%s) is not exist.' %(', '.join(missing)), volumes=volumes, missing=missing)
+        ecl2_exit_json(module, volumes=volumes, missing=missing, duplicated=duplicated, changed=False)
+        return True
+
+    #
+    # ボリュームの検索 (ID が指定された場合は ID で取得)
+    #
+    if not volume_id == None:
+        volume = get_storage_volume(ecl2, volume_id)
+        name = volume_id
+    else:
+        index = ecl2_name_index_from_module(module)
+        volume = _find_storage_volume_detail_by_name(ecl2, name, index)
 
     #
     # ボリュームが存在しない場合
     #
     if volume == None:
-        module.fail_json(msg='Volume (%s) is not exist.' %(name))
+        ecl2_fail_json(module, msg='Volume (%s) is not exist.' %(name))
 
     #
     # 正常終了
     #
-    module.exit_json(volume=volume, changed=False)
+    ecl2_exit_json(module, volume=volume, id=volume['id'], changed=False)
     return True
 
 #
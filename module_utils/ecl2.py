@@ -0,0 +1,2229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# ECL2.0 モジュール共通処理
+#
+import calendar
+import email.utils
+import fnmatch
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import socket
+import struct
+import threading
+import time
+
+from ansible.module_utils.openstack import openstack_full_argument_spec
+from ansible.module_utils.six.moves.urllib.parse import urlparse
+
+#
+# ECLSDK の有無の確認 (読み込みは接続時に行う、ブローカー経由の場合は読み込まない)
+#
+def _has_module(name):
+    try:
+        import importlib.util
+        return not importlib.util.find_spec(name) == None
+    except ImportError:
+        import imp
+        try:
+            imp.find_module(name)
+            return True
+        except ImportError:
+            return False
+
+HAS_ECLSDK = _has_module('ecl')
+eclsdk = None
+
+try:
+    import fcntl
+    HAS_FCNTL=True
+except:
+    HAS_FCNTL=False
+
+try:
+    import sqlite3
+    HAS_SQLITE3=True
+except:
+    HAS_SQLITE3=False
+
+#
+# キャッシュファイルの既定の配置先
+#
+ECL2_CACHE_DIR = os.path.join('~', '.cache', 'ecl2-ansible')
+
+#
+# トークンの有効期限の何秒前に再認証するか
+#
+TOKEN_REFRESH_MARGIN = 300
+
+#
+# 名前インデックスの既定の有効期間(秒)
+#
+NAME_INDEX_TTL = 300
+
+#
+# 仮想ストレージのボリュームタイプ (固定) / 指定可能なボリュームのサイズ / IOPS / 作成時の既定値
+#
+STORAGE_VOLUME_TYPE_ID = '6328d234-7939-4d61-9216-736de66d15f9'
+VOLUME_SIZES = [100, 250, 500, 1000, 2000, 4000, 8000, 12000]
+VOLUME_IOPS_PER_GB = ['2', '4']
+VOLUME_DEFAULT_SIZE = 100
+VOLUME_DEFAULT_IOPS_PER_GB = '2'
+
+#
+# 一覧をページ毎に取得する場合の1ページの件数
+#
+LIST_PAGE_SIZE = 100
+
+#
+# 状態待ちのポーリング間隔(秒) / 最大間隔(秒) / 増加率 / ゆらぎ
+#
+WAIT_INTERVAL = 2
+WAIT_MAX_INTERVAL = 30
+WAIT_BACKOFF = 1.5
+WAIT_JITTER = 0.2
+
+#
+# 削除中の状態 (削除を再度実行しない)
+#
+DELETING_STATUSES = ['deleting']
+
+#
+# ブローカーの既定の待機時間(秒) / 起動待ちの時間(秒)
+#
+BROKER_IDLE_TIMEOUT = 600
+BROKER_START_TIMEOUT = 60
+
+#
+# 同一の参照呼び出しを共有する期間(秒) / 共有ファイルを削除するまでの時間(秒)
+#
+COALESCE_WINDOW = 1.0
+COALESCE_CLEANUP_AGE = 600
+
+#
+# API 呼び出しの再試行 (再試行する HTTP ステータス / 間隔の上限(秒) / ゆらぎ)
+#
+RETRY_STATUSES = [429, 502, 503, 504]
+RETRY_MAX_INTERVAL = 60
+RETRY_JITTER = 0.2
+
+#
+# サーキットブレーカー (障害とみなす HTTP ステータス / 既定の連続失敗回数 / 既定の遮断時間(秒))
+#
+CIRCUIT_FAILURE_STATUSES = [500, 502, 503, 504]
+CIRCUIT_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 60
+
+#
+# 記録から除く項目 (値を置き換える)
+#
+SCRUB_KEYS = ['password', 'secret', 'username', 'token', 'access_token', 'api_key']
+SCRUB_HEADERS = ['X-Auth-Token', 'X-Subject-Token', 'Set-Cookie']
+SCRUBBED = 'REDACTED'
+
+#
+# 再実行しても結果が変わらない HTTP メソッド
+#
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+
+#
+# 参照系の API (同一の呼び出しを共有できるもの)
+#
+READ_METHODS = ['storages', 'volumes', 'networks', 'subnets']
+
+#
+# 更新系の API (呼び出した場合は共有している結果を破棄する)
+#
+WRITE_METHOD_PREFIXES = ['create_', 'update_', 'delete_']
+
+#
+# 実行中に収集した情報 (モジュールの結果に付与する)
+#
+_RUN_INFO = {}
+
+#
+# 実行中の状態 (接続先テナント等)
+#
+_RUN_STATE = {}
+
+#
+# ECL2.0 モジュール共通引数
+#
+def ecl2_argument_spec(**kwargs):
+    spec = dict(
+        token_cache=dict(default=False, type='bool'),
+        token_cache_path=dict(default=None, type='path'),
+        cache=dict(default='bypass', choices=['bypass', 'use', 'refresh']),
+        cache_ttl=dict(default=NAME_INDEX_TTL, type='int'),
+        cache_path=dict(default=None, type='path'),
+        broker=dict(default=False, type='bool'),
+        broker_idle_timeout=dict(default=BROKER_IDLE_TIMEOUT, type='int'),
+        coalesce=dict(default=False, type='bool'),
+        coalesce_window=dict(default=COALESCE_WINDOW, type='float'),
+        rate_limit=dict(default=None, type='dict'),
+        api_retries=dict(default=0, type='int'),
+        api_retry_backoff=dict(default=1.0, type='float'),
+        circuit_breaker=dict(default=False, type='bool'),
+        circuit_breaker_threshold=dict(default=CIRCUIT_THRESHOLD, type='int'),
+        circuit_breaker_reset=dict(default=CIRCUIT_RESET_TIMEOUT, type='int'),
+        metrics=dict(default=True, type='bool'),
+        trace_file=dict(default=None, type='path'),
+        api_record=dict(default=None, type='path'),
+        api_replay=dict(default=None, type='path'),
+        api_replay_speed=dict(default='recorded', choices=['recorded', 'fast']),
+        plan_snapshot=dict(default=None, type='path')
+    )
+    spec.update(kwargs)
+    return openstack_full_argument_spec(**spec)
+
+#
+# 正常終了 (共通情報を結果に付与する)
+#
+def ecl2_exit_json(module, **kwargs):
+    for key, value in _RUN_INFO.items():
+        kwargs.setdefault(key, value)
+    module.exit_json(**kwargs)
+
+#
+# 異常終了 (共通情報を結果に付与する)
+#
+def ecl2_fail_json(module, **kwargs):
+    for key, value in _RUN_INFO.items():
+        kwargs.setdefault(key, value)
+    module.fail_json(**kwargs)
+
+#
+# モジュールの本体の実行
+#
+# - サーキットブレーカーが遮断中の場合は例外ではなく異常終了とする
+#
+def ecl2_run(module, function):
+    try:
+        return function(module)
+    except Ecl2CircuitOpenError as e:
+        ecl2_fail_json(module, msg=str(e))
+
+#
+# キャッシュファイルのパスを取得
+#
+def ecl2_cache_path(filename, path=None):
+    if path == None:
+        path = os.path.join(ECL2_CACHE_DIR, filename)
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            # 他のプロセスが同時に作成した場合
+            if not os.path.isdir(directory):
+                raise
+    return path
+
+#
+# ファイルロック (複数のプロセスで共有するファイルの排他)
+#
+def _lock_file(path):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    if HAS_FCNTL:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    return fd
+
+def _unlock_file(fd):
+    if HAS_FCNTL:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+#
+# JSON ファイルの読み込み (読めない場合は None)
+#
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+#
+# JSON ファイルの書き込み (一時ファイルに 0600 で書き込んでから置き換える)
+#
+def _write_json(path, data):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, default=str)
+    os.rename(tmp_path, path)
+
+#
+# Cloud インスタンスの取得
+#
+def _get_cloud_from_module(module):
+    try:
+        #
+        # モジュールから接続情報を取得するためのユーティリティを読み込み
+        #
+        from ansible.module_utils.openstack import openstack_cloud_from_module
+
+        #
+        # Cloud インスタンスの取得
+        #
+        sdk, cloud = openstack_cloud_from_module(module)
+    except:
+        #
+        # Clouds.yaml の 情報読み込み
+        #
+        cloud = _get_cloud(module.params['cloud'])
+    return cloud
+
+#
+# Clouds.yaml の クラウド名から Cloud インスタンスを取得
+#
+def _get_cloud(cloud_name):
+    import openstack
+    return openstack.connect(cloud=cloud_name)
+
+#
+# ECL2.0 の 認証情報を取得
+#
+def ecl2_auth_args_from_cloud(cloud):
+    #
+    # 設定情報の取り出し
+    #
+    # [参考]
+    # {
+    #   'username'          : 'API 鍵',
+    #   'password'          : 'API 秘密鍵',
+    #   'project_id'        : 'テナントID',
+    #   'user_domain_id'    : 'default',
+    #   'project_domain_id' : 'default',
+    #   'auth_url'          : '認証サーバURL'
+    # }
+    #
+    auth_args = cloud.config.get_auth_args()
+
+    #
+    # 不要な項目はフィルタ
+    #
+    return {
+        'username'          : auth_args['username'],
+        'password'          : auth_args['password'],
+        'project_id'        : auth_args['project_id'],
+        'user_domain_id'    : auth_args['user_domain_id'],
+        'project_domain_id' : auth_args['project_domain_id'],
+        'auth_url'          : auth_args['auth_url']
+    }
+
+#
+# ECL接続
+#
+# - broker=yes の場合は常駐プロセス経由で接続する (起動できない場合は直接接続する)
+# - coalesce=yes の場合は同時に実行された同一の参照呼び出しを共有する
+#   (ブローカー経由の場合はブローカー内で、直接接続の場合は共有ファイルで行う)
+# - circuit_breaker=yes の場合、遮断中の API があれば接続せずにエラーとする
+# - api_record / api_replay を指定した場合はブローカーを使用しない
+#
+def ecl2_connection_from_module(module):
+    replaying = module.params.get('api_record') or module.params.get('api_replay')
+    if module.params.get('broker') and not replaying:
+        connection = ecl2_broker_connection(module)
+        if not connection == None:
+            _check_circuit(module, _RUN_STATE['tenant'])
+            return connection
+
+    connection = _ecl2_direct_connection(module, check_circuit=True)
+    if module.params.get('coalesce'):
+        coalescer = Ecl2FileCoalescer(_RUN_STATE['tenant'])
+        _RUN_INFO['ecl2_coalesce'] = coalescer.stats
+        connection = Ecl2CoalescingConnection(connection, coalescer, module.params.get('coalesce_window'))
+    return connection
+
+#
+# ECL接続 (ブローカーを使用しない)
+#
+def _ecl2_direct_connection(module, check_circuit=False):
+    cloud = _get_cloud_from_module(module)
+    ecl2_args = ecl2_auth_args_from_cloud(cloud)
+    if check_circuit:
+        _check_circuit(module, _tenant_key(ecl2_args))
+    #
+    # 記録 / 再生 する場合は認証も記録の対象とするため、トークンキャッシュを使用しない
+    # (トークンキャッシュは記録の前に認証を行う)
+    #
+    recording = module.params.get('api_record') or module.params.get('api_replay')
+    connection = ecl2_connection(ecl2_args,
+                                 token_cache=module.params.get('token_cache') and not recording,
+                                 token_cache_path=module.params.get('token_cache_path'))
+    ecl2_install_request_layers(connection, module.params, getattr(module, '_name', None))
+    return connection
+
+#
+# 遮断中の API があればエラーとする
+#
+def _check_circuit(module, tenant):
+    if not module.params.get('circuit_breaker'):
+        return
+    error = _circuit_breaker(module.params, tenant).check()
+    if not error == None:
+        ecl2_fail_json(module, msg=error)
+
+#
+# ECL接続 (Clouds.yaml の クラウド名を指定、プラグイン等から使用)
+#
+def ecl2_connection_from_cloud(cloud_name, token_cache=False, token_cache_path=None):
+    cloud = _get_cloud(cloud_name)
+    return ecl2_connection(ecl2_auth_args_from_cloud(cloud),
+                           token_cache=token_cache,
+                           token_cache_path=token_cache_path)
+
+#
+# ECL2.0に接続する
+#
+def ecl2_connection(ecl2_args, token_cache=False, token_cache_path=None):
+    _RUN_STATE['tenant'] = _tenant_key(ecl2_args)
+
+    #
+    # トークンキャッシュを使用しない場合は毎回認証する
+    #
+    if not token_cache:
+        return _eclsdk().connection.Connection(**ecl2_args)
+
+    cache = Ecl2TokenCache(token_cache_path)
+    connection = cache.connect(ecl2_args)
+    _RUN_INFO['ecl2_token_cache'] = cache.stats
+    return connection
+
+#
+# ECLSDK の読み込み
+#
+def _eclsdk():
+    global eclsdk
+    if eclsdk == None:
+        import ecl.connection
+        eclsdk = ecl
+    return eclsdk
+
+#
+# テナントを識別するキー
+#
+def _tenant_key(ecl2_args):
+    source = '\n'.join([ecl2_args['auth_url'], ecl2_args['project_id']])
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+#
+# Keystone トークンのキャッシュ
+#
+# - 認証URL / テナントID / ユーザ名 単位でトークンとサービスカタログを保存する
+# - ファイルはロックした上で 0600 で書き込む
+# - 有効期限の TOKEN_REFRESH_MARGIN 秒前を過ぎたトークンは再認証する
+#
+class Ecl2TokenCache(object):
+
+    def __init__(self, path=None, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.path = ecl2_cache_path('tokens.json', path)
+        self.refresh_margin = refresh_margin
+        self.stats = {'hit': False, 'hits': 0, 'misses': 0}
+
+    #
+    # キャッシュのキー (認証情報そのものは保存しない)
+    #
+    def _key(self, ecl2_args):
+        source = '\n'.join([ecl2_args['auth_url'], ecl2_args['project_id'], ecl2_args['username']])
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        data = _read_json(self.path) or {}
+        data.setdefault('tokens', {})
+        data.setdefault('stats', {'hits': 0, 'misses': 0})
+        return data
+
+    #
+    # キャッシュされたトークンで接続、無ければ認証してキャッシュする
+    #
+    def connect(self, ecl2_args):
+        fd = _lock_file(self.path + '.lock')
+        try:
+            data = self._load()
+            now = time.time()
+
+            #
+            # 期限切れのトークンを削除
+            #
+            for key, entry in list(data['tokens'].items()):
+                if entry.get('expires_at', 0) - self.refresh_margin <= now:
+                    del data['tokens'][key]
+
+            key = self._key(ecl2_args)
+            connection = None
+            entry = data['tokens'].get(key)
+            if not entry == None:
+                connection = _ecl_connection_from_token(ecl2_args, entry)
+
+            if not connection == None:
+                data['stats']['hits'] += 1
+                self.stats['hit'] = True
+            else:
+                data['stats']['misses'] += 1
+                connection = _eclsdk().connection.Connection(**ecl2_args)
+                entry = _token_from_connection(connection)
+                if not entry == None:
+                    data['tokens'][key] = entry
+
+            _write_json(self.path, data)
+            self.stats['hits'] = data['stats']['hits']
+            self.stats['misses'] = data['stats']['misses']
+        finally:
+            _unlock_file(fd)
+        return connection
+
+#
+# 接続からトークン情報を取り出す (認証を行う)
+#
+def _token_from_connection(connection):
+    try:
+        session = connection.session
+        access_info = session.auth.get_access(session)
+        return {
+            'auth_token' : access_info.auth_token,
+            'body'       : access_info._data,
+            'expires_at' : calendar.timegm(access_info.expires.utctimetuple())
+        }
+    except Exception:
+        # トークンを取り出せない場合はキャッシュしない
+        return None
+
+#
+# キャッシュされたトークンから接続を作成 (認証は行わない)
+#
+# パスワード認証のプラグインにトークンを設定するため、実行中 (ブローカーの常駐中を含む) に
+# トークンの期限が近づいた場合や 401 になった場合はプラグインが再認証する
+#
+def _ecl_connection_from_token(ecl2_args, entry):
+    try:
+        from keystoneauth1 import access
+        auth_ref = access.create(body=entry['body'], auth_token=entry['auth_token'])
+        connection = _eclsdk().connection.Connection(**ecl2_args)
+        connection.session.auth.auth_ref = auth_ref
+        return connection
+    except Exception:
+        # 復元できない場合は再認証する
+        return None
+
+#
+# ブローカー経由の接続
+#
+# - クラウド毎に常駐プロセス (ブローカー) を起動し、認証済みの接続を保持させる
+# - モジュールは Unix ソケットでブローカーに API 呼び出しを依頼する
+#   (openstack / ECLSDK の読み込みと認証を毎回行わない)
+# - ブローカーは broker_idle_timeout 秒間呼び出しが無ければ終了する
+#
+def ecl2_broker_connection(module):
+    if not hasattr(os, 'fork') or not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    path = ecl2_cache_path('broker-%s.sock' % _broker_key(module.params)[:16])
+    client = Ecl2BrokerClient(path, module.params.get('coalesce_window') if module.params.get('coalesce') else None)
+    if module.params.get('metrics') or module.params.get('trace_file'):
+        client.metrics = Ecl2Metrics(module.params.get('trace_file'), getattr(module, '_name', None))
+    started = False
+    try:
+        if not client.ping():
+            #
+            # 同時に複数のブローカーを起動しないようにロックする
+            #
+            fd = _lock_file(path + '.lock')
+            try:
+                if not client.ping():
+                    _start_broker(module, path)
+                    started = True
+                    deadline = time.time() + BROKER_START_TIMEOUT
+                    while not client.ping():
+                        if time.time() > deadline:
+                            raise Ecl2BrokerError('Broker did not start: %s' % path)
+                        time.sleep(0.1)
+            finally:
+                _unlock_file(fd)
+    except Exception as e:
+        _RUN_INFO['ecl2_broker'] = {'socket': path, 'used': False, 'error': str(e)}
+        return None
+
+    _RUN_STATE['tenant'] = client.tenant
+    _RUN_INFO['ecl2_broker'] = {'socket': path, 'used': True, 'started': started}
+    if module.params.get('metrics') and not client.metrics == None:
+        _RUN_INFO['ecl2_metrics'] = client.metrics.summary
+    if not client.coalesce_window == None:
+        _RUN_INFO['ecl2_coalesce'] = client.stats
+    return Ecl2BrokerConnection(client)
+
+#
+# ブローカーを識別するキー (接続に関係する引数から作成する)
+#
+# - 再試行 / 流量制限 / サーキットブレーカー / 計測 はブローカー内の接続に設定されるため、
+#   これらの設定が異なるタスクは別のブローカーを使う
+#
+BROKER_KEY_PARAMS = ['cloud', 'auth', 'auth_type', 'region_name', 'interface', 'token_cache', 'token_cache_path',
+                     'rate_limit', 'api_retries', 'api_retry_backoff',
+                     'circuit_breaker', 'circuit_breaker_threshold', 'circuit_breaker_reset', 'metrics', 'trace_file']
+
+def _broker_key(params):
+    source = dict([(key, params.get(key)) for key in BROKER_KEY_PARAMS])
+    source['uid'] = os.getuid()
+    return hashlib.sha256(json.dumps(source, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+#
+# ブローカーの起動
+#
+# - 2回 fork してモジュールの実行から切り離す
+# - 標準入出力は閉じる (Ansible はモジュールの標準出力が閉じられるまで待つため)
+#
+def _start_broker(module, path):
+    pid = os.fork()
+    if pid > 0:
+        os.waitpid(pid, 0)
+        return
+
+    try:
+        os.setsid()
+        if os.fork() > 0:
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in [0, 1, 2]:
+            os.dup2(devnull, fd)
+
+        connection = _ecl2_direct_connection(module)
+        Ecl2Broker(connection, path, module.params.get('broker_idle_timeout'), _RUN_STATE['tenant']).serve()
+    finally:
+        os._exit(0)
+
+#
+# ブローカーとのメッセージ (4 バイトの長さ + JSON)
+#
+def _broker_send(sock, message):
+    data = json.dumps(message, default=str).encode('utf-8')
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+def _broker_recv(sock):
+    header = _broker_recv_exactly(sock, 4)
+    if header == None:
+        return None
+    data = _broker_recv_exactly(sock, struct.unpack('!I', header)[0])
+    if data == None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+def _broker_recv_exactly(sock, length):
+    chunks = []
+    while length > 0:
+        chunk = sock.recv(min(length, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b''.join(chunks)
+
+#
+# API の戻り値をメッセージに変換 (リソースは to_dict() の結果、ジェネレータはリスト)
+#
+def _encode_resources(value):
+    if hasattr(value, 'to_dict'):
+        return {'__resource__': value.to_dict()}
+    if isinstance(value, (list, tuple)) or _is_iterator(value):
+        return [_encode_resources(item) for item in value]
+    return value
+
+def _decode_resources(value):
+    if isinstance(value, dict) and '__resource__' in value:
+        return Ecl2Resource(value['__resource__'])
+    if isinstance(value, list):
+        return [_decode_resources(item) for item in value]
+    return value
+
+#
+# ブローカーから返されたエラー
+#
+class Ecl2BrokerError(Exception):
+
+    def __init__(self, message, error_type=None, http_status=None):
+        super(Ecl2BrokerError, self).__init__(message)
+        self.error_type = error_type
+        self.http_status = http_status
+
+#
+# ブローカーから返されたリソース (属性 / to_dict() で参照する)
+#
+class Ecl2Resource(object):
+
+    def __init__(self, record):
+        self._record = record
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._record.get(name)
+
+    def to_dict(self):
+        return dict(self._record)
+
+#
+# ブローカーのクライアント (スレッド毎にソケットを保持する)
+#
+class Ecl2BrokerClient(object):
+
+    def __init__(self, path, coalesce_window=None):
+        self.path = path
+        self.coalesce_window = coalesce_window
+        self.tenant = None
+        self.stats = {'calls': 0, 'shared': 0}
+        self.metrics = None
+        self._local = threading.local()
+
+    def _socket(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock == None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except Exception:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def _request(self, message):
+        sock = self._socket()
+        try:
+            _broker_send(sock, message)
+            response = _broker_recv(sock)
+        except Exception:
+            self._local.sock = None
+            sock.close()
+            raise
+        if response == None:
+            self._local.sock = None
+            sock.close()
+            raise Ecl2BrokerError('Broker closed the connection: %s' % self.path)
+        return response
+
+    def ping(self):
+        try:
+            response = self._request({'op': 'ping'})
+        except Exception:
+            return False
+        self.tenant = response.get('tenant')
+        return True
+
+    def call(self, service, method, args, kwargs):
+        started = time.time()
+        response = self._request({'op': 'call', 'service': service, 'method': method, 'args': list(args), 'kwargs': kwargs,
+                                  'coalesce_window': self.coalesce_window})
+        if not self.metrics == None:
+            error = response.get('error') or {}
+            self.metrics.record(service, method, None, error.get('http_status') or error.get('type'),
+                                None, time.time() - started)
+        if not self.coalesce_window == None and method in READ_METHODS:
+            self.stats['shared' if response.get('shared') else 'calls'] += 1
+        error = response.get('error')
+        if not error == None:
+            # 一覧の引数が使えない場合の判定 (TypeError) はそのまま返す
+            if error['type'] == 'TypeError':
+                raise TypeError(error['message'])
+            # ブローカー内のサーキットブレーカーが遮断中の場合
+            if error['type'] == 'Ecl2CircuitOpenError':
+                raise Ecl2CircuitOpenError(error['message'])
+            raise Ecl2BrokerError(error['message'], error['type'], error.get('http_status'))
+        return _decode_resources(response.get('result'))
+
+#
+# ブローカー経由の接続 (cloud_ecl2.storage.volumes() 等を ECLSDK の接続と同様に呼び出せる)
+#
+class Ecl2BrokerConnection(object):
+
+    def __init__(self, client):
+        self.storage = _Ecl2BrokerService(client, 'storage')
+        self.network = _Ecl2BrokerService(client, 'network')
+
+class _Ecl2BrokerService(object):
+
+    def __init__(self, client, service):
+        self._client = client
+        self._service = service
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        def call(*args, **kwargs):
+            return self._client.call(self._service, method, args, kwargs)
+        return call
+
+#
+# ブローカー (常駐プロセス)
+#
+# - 接続毎にスレッドで API 呼び出しを処理する
+# - 接続中のクライアントが無く idle_timeout 秒経過したら終了する
+#
+class Ecl2Broker(object):
+
+    SERVICES = ['storage', 'network']
+
+    def __init__(self, connection, path, idle_timeout=BROKER_IDLE_TIMEOUT, tenant=None):
+        self.connection = connection
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.tenant = tenant
+        self.lock = threading.Lock()
+        self.clients = 0
+        self.last_used = time.time()
+        self.coalescer = Ecl2Coalescer()
+
+    def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen(128)
+        server.settimeout(1)
+        try:
+            while True:
+                try:
+                    sock, address = server.accept()
+                except socket.timeout:
+                    with self.lock:
+                        if self.clients == 0 and time.time() - self.last_used > self.idle_timeout:
+                            break
+                    continue
+                with self.lock:
+                    self.clients += 1
+                sock.settimeout(None)
+                thread = threading.Thread(target=self._handle, args=(sock,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _handle(self, sock):
+        try:
+            while True:
+                request = _broker_recv(sock)
+                if request == None:
+                    break
+                _broker_send(sock, self._execute(request))
+                with self.lock:
+                    self.last_used = time.time()
+        except Exception:
+            pass
+        finally:
+            sock.close()
+            with self.lock:
+                self.clients -= 1
+                self.last_used = time.time()
+
+    def _execute(self, request):
+        if request.get('op') == 'ping':
+            return {'tenant': self.tenant}
+        service = request.get('service')
+        method = request.get('method', '')
+        if not service in self.SERVICES or method.startswith('_'):
+            return {'error': {'type': 'ValueError', 'message': 'Unsupported call: %s.%s' % (service, method)}}
+        try:
+            function = getattr(getattr(self.connection, service), method)
+            args = request.get('args', [])
+            kwargs = request.get('kwargs', {})
+            window = request.get('coalesce_window')
+            if window == None or not method in READ_METHODS:
+                result = function(*args, **kwargs)
+                if _is_write_method(method):
+                    self.coalescer.invalidate()
+                return {'result': _encode_resources(result)}
+            key = _coalesce_key(None, service, method, args, kwargs)
+            result, shared = self.coalescer.call(key, lambda: function(*args, **kwargs), window)
+            return {'result': _encode_resources(result), 'shared': shared}
+        except Exception as e:
+            return {'error': {'type': type(e).__name__, 'message': str(e), 'http_status': getattr(e, 'http_status', None)}}
+
+#
+# HTTP リクエストの前後処理
+#
+# - 接続のセッションの request を置き換え、認証を含む全ての HTTP リクエストに処理を加える
+# - 処理 (レイヤー) は layer(request, url, method, **kwargs) の形で、request を呼び出して結果を返す
+# - 後から追加したレイヤーが外側になる
+#
+def ecl2_add_request_layer(connection, layer):
+    session = getattr(connection, 'session', None)
+    if session == None:
+        return False
+    request = session.request
+
+    def wrapped(url, method, **kwargs):
+        return layer(request, url, method, **kwargs)
+    session.request = wrapped
+    return True
+
+#
+# 引数に応じたレイヤーの追加
+#
+# - 記録 / 再生 (最も内側) / 計測 (再試行を含む全ての送信を記録する) / 送信数の制限と再試行 /
+#   サーキットブレーカー (外側) の順に重ねる
+#
+def ecl2_install_request_layers(connection, params, task=None):
+    if params.get('api_replay'):
+        replay = Ecl2Replay(params['api_replay'], params.get('api_replay_speed') != 'fast')
+        if ecl2_add_request_layer(connection, replay):
+            _RUN_INFO['ecl2_replay'] = replay.stats
+    elif params.get('api_record'):
+        ecl2_add_request_layer(connection, Ecl2Recorder(params['api_record'], task))
+
+    if params.get('metrics') or params.get('trace_file'):
+        metrics = Ecl2Metrics(params.get('trace_file'), task)
+        if ecl2_add_request_layer(connection, metrics) and params.get('metrics'):
+            _RUN_INFO['ecl2_metrics'] = metrics.summary
+
+    rate_limit = params.get('rate_limit')
+    retries = params.get('api_retries') or 0
+    if rate_limit or retries > 0:
+        limiter = None
+        if rate_limit:
+            limiter = Ecl2RateLimiter(rate_limit)
+        retry = Ecl2Retry(limiter, retries, params.get('api_retry_backoff'))
+        if ecl2_add_request_layer(connection, retry):
+            _RUN_INFO['ecl2_throttle'] = retry.stats
+
+    if params.get('circuit_breaker'):
+        ecl2_add_request_layer(connection, _circuit_breaker(params, _RUN_STATE['tenant']))
+
+def _circuit_breaker(params, tenant):
+    return Ecl2CircuitBreaker(tenant,
+                              threshold=params.get('circuit_breaker_threshold') or CIRCUIT_THRESHOLD,
+                              reset_timeout=params.get('circuit_breaker_reset') or CIRCUIT_RESET_TIMEOUT)
+
+#
+# リクエストの送信先 (サービス種別、認証の場合は identity)
+#
+def _endpoint_name(url, kwargs):
+    if kwargs.get('authenticated') == False:
+        return 'identity'
+    endpoint_filter = kwargs.get('endpoint_filter')
+    if not endpoint_filter == None:
+        service_type = getattr(endpoint_filter, 'service_type', None)
+        if service_type == None and isinstance(endpoint_filter, dict):
+            service_type = endpoint_filter.get('service_type')
+        if service_type:
+            return service_type
+    return urlparse(url).netloc or 'default'
+
+#
+# レスポンス / 例外 から HTTP ステータスを取得
+#
+def _http_status(response, error):
+    if not error == None:
+        status = getattr(error, 'http_status', None)
+        if status == None:
+            status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status
+    return getattr(response, 'status_code', None)
+
+#
+# 接続できなかった場合の例外かどうか
+#
+def _is_connect_failure(error):
+    name = type(error).__name__
+    return 'ConnectFailure' in name or 'ConnectionError' in name or 'Timeout' in name
+
+#
+# Retry-After ヘッダの秒数 (無い場合は None)
+#
+def _retry_after(response):
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if value == None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        if parsed == None:
+            return None
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+#
+# 送信数の制限 (トークンバケット)
+#
+# - 送信先毎のバケットをファイルに保存し、コントローラ上の全てのモジュールで共有する
+# - rates は 送信先 (storage / network / identity 等、default は その他) 毎の 1 秒あたりの送信数
+# - 1 秒分までまとめて送信できる
+#
+class Ecl2RateLimiter(object):
+
+    def __init__(self, rates, path=None):
+        self.rates = rates
+        self.path = ecl2_cache_path('ratelimit.json', path)
+        self.stats = {'waits': 0, 'waited': 0.0}
+
+    def _rate(self, endpoint):
+        rate = self.rates.get(endpoint, self.rates.get('default'))
+        if rate == None:
+            return None
+        return float(rate)
+
+    def acquire(self, endpoint):
+        rate = self._rate(endpoint)
+        if not rate or rate <= 0:
+            return
+        burst = max(1.0, rate)
+        while True:
+            fd = _lock_file(self.path + '.lock')
+            try:
+                now = time.time()
+                data = _read_json(self.path) or {}
+                bucket = data.get(endpoint) or {'tokens': burst, 'updated': now}
+                tokens = min(burst, bucket['tokens'] + max(0.0, now - bucket['updated']) * rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / rate
+                data[endpoint] = {'tokens': tokens, 'updated': now}
+                _write_json(self.path, data)
+            finally:
+                _unlock_file(fd)
+            if wait == 0:
+                return
+            self.stats['waits'] += 1
+            self.stats['waited'] += wait
+            time.sleep(wait)
+
+#
+# 送信数の制限と再試行 (レイヤー)
+#
+# - 429 / 502 / 503 / 504 と接続失敗の場合に最大 retries 回再試行する
+#   (POST 等の再実行できないリクエストは、処理されていない 429 の場合のみ)
+# - Retry-After ヘッダがあればその秒数、無ければ backoff 秒から倍々に待つ
+#
+class Ecl2Retry(object):
+
+    def __init__(self, limiter=None, retries=0, backoff=1.0):
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff or 1.0
+        self.stats = {'retries': 0}
+        if not limiter == None:
+            self.stats = limiter.stats
+            self.stats['retries'] = 0
+
+    def _retryable(self, method, status, error):
+        if status == 429:
+            return True
+        if not method.upper() in IDEMPOTENT_METHODS:
+            return False
+        if status in RETRY_STATUSES:
+            return True
+        return status == None and not error == None and _is_connect_failure(error)
+
+    def _delay(self, response, attempt):
+        delay = _retry_after(response)
+        if delay == None:
+            delay = self.backoff * (2 ** attempt)
+            delay = delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+        return min(delay, RETRY_MAX_INTERVAL)
+
+    def __call__(self, request, url, method, **kwargs):
+        endpoint = _endpoint_name(url, kwargs)
+        attempt = 0
+        while True:
+            if not self.limiter == None:
+                self.limiter.acquire(endpoint)
+            try:
+                response = request(url, method, **kwargs)
+                error = None
+            except Exception as e:
+                response = getattr(e, 'response', None)
+                error = e
+            status = _http_status(response, error)
+
+            if attempt >= self.retries or not self._retryable(method, status, error):
+                if not error == None:
+                    raise error
+                return response
+            time.sleep(self._delay(response, attempt))
+            attempt += 1
+            self.stats['retries'] += 1
+
+#
+# レスポンスのサイズ (バイト)
+#
+def _response_size(response):
+    headers = getattr(response, 'headers', None) or {}
+    length = headers.get('Content-Length')
+    if not length == None:
+        try:
+            return int(length)
+        except ValueError:
+            pass
+    try:
+        return len(response.content or b'')
+    except Exception:
+        return None
+
+#
+# API 呼び出しの計測 (レイヤー)
+#
+# - 送信先 / HTTP メソッド 毎に 回数 / エラー数 / バイト数 / 時間 を集計する (summary)
+# - trace_file を指定した場合は1リクエスト毎に JSON 1行を追記する
+#
+class Ecl2Metrics(object):
+
+    def __init__(self, trace_file=None, task=None):
+        self.trace_file = trace_file
+        self.task = task
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.summary = {'requests': 0, 'errors': 0, 'bytes': 0, 'duration': 0.0, 'elapsed': 0.0, 'operations': {}}
+        self._totals = {}
+
+    def _add(self, key, status, size, duration):
+        totals = self._totals.setdefault(key, {'requests': 0, 'errors': 0, 'bytes': 0, 'duration': 0.0, 'max': 0.0})
+        totals['requests'] += 1
+        if not isinstance(status, int) or status >= 400:
+            totals['errors'] += 1
+        totals['bytes'] += size or 0
+        totals['duration'] += duration
+        totals['max'] = max(totals['max'], duration)
+        return totals
+
+    def record(self, endpoint, method, path, status, size, duration):
+        operation = '%s %s' % (method, endpoint)
+        with self.lock:
+            total = self._add(None, status, size, duration)
+            self.summary.update(requests=total['requests'], errors=total['errors'], bytes=total['bytes'],
+                                duration=round(total['duration'], 3), elapsed=round(time.time() - self.started, 3))
+            totals = self._add(operation, status, size, duration)
+            self.summary['operations'][operation] = {
+                'requests' : totals['requests'],
+                'errors'   : totals['errors'],
+                'bytes'    : totals['bytes'],
+                'duration' : round(totals['duration'], 3),
+                'max'      : round(totals['max'], 3)
+            }
+
+        if not self.trace_file == None:
+            self._trace({'time': round(time.time(), 3), 'pid': os.getpid(), 'task': self.task, 'endpoint': endpoint,
+                         'method': method, 'path': path, 'status': status, 'bytes': size, 'duration': round(duration, 6)})
+
+    #
+    # 追記 (1行ずつ書き込むため、複数のプロセスが同じファイルに追記できる)
+    #
+    def _trace(self, record):
+        line = (json.dumps(record, sort_keys=True, default=str) + '\n').encode('utf-8')
+        try:
+            fd = os.open(os.path.expanduser(self.trace_file), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except (IOError, OSError):
+            # 計測の失敗でモジュールを失敗させない
+            pass
+
+    def __call__(self, request, url, method, **kwargs):
+        started = time.time()
+        response = None
+        error = None
+        try:
+            response = request(url, method, **kwargs)
+            return response
+        except Exception as e:
+            response = getattr(e, 'response', None)
+            error = e
+            raise
+        finally:
+            status = _http_status(response, error)
+            if status == None and not error == None:
+                status = type(error).__name__
+            self.record(_endpoint_name(url, kwargs), method.upper(), urlparse(url).path or url, status,
+                        _response_size(response), time.time() - started)
+
+#
+# 秘密情報の置き換え (辞書 / リストを再帰的に処理する)
+#
+def _scrub(value):
+    if isinstance(value, dict):
+        scrubbed = {}
+        for key, item in value.items():
+            if key in SCRUB_KEYS and not isinstance(item, (dict, list)):
+                scrubbed[key] = SCRUBBED
+            else:
+                scrubbed[key] = _scrub(item)
+        return scrubbed
+    if isinstance(value, list):
+        return [_scrub(item) for item in value]
+    return value
+
+def _scrub_headers(headers):
+    scrubbed = {}
+    for key, value in (headers or {}).items():
+        if key.lower() in [name.lower() for name in SCRUB_HEADERS]:
+            value = SCRUBBED
+        scrubbed[key] = value
+    return scrubbed
+
+#
+# 記録 / 再生 で同じリクエストを判定するキー
+#
+def _exchange_key(endpoint, method, url):
+    parsed = urlparse(url)
+    path = parsed.path
+    if parsed.query:
+        path = '%s?%s' % (path, parsed.query)
+    return '%s %s %s' % (method.upper(), endpoint, path)
+
+#
+# API のやり取りの記録 (レイヤー)
+#
+# - 1リクエスト毎に JSON 1行 (リクエスト / レスポンス / 時間 / 例外) を追記する
+# - パスワード / API 鍵 / トークン 等は REDACTED に置き換える (認証のリクエストの内容は記録しない)
+#
+class Ecl2Recorder(object):
+
+    def __init__(self, path, task=None):
+        self.path = os.path.expanduser(path)
+        self.task = task
+
+    def _body(self, response, endpoint):
+        if response == None:
+            return None
+        try:
+            body = response.text
+        except Exception:
+            return None
+        if endpoint == 'identity' and body:
+            try:
+                body = json.dumps(_scrub_identity(json.loads(body)))
+            except ValueError:
+                body = SCRUBBED
+        return body
+
+    def __call__(self, request, url, method, **kwargs):
+        endpoint = _endpoint_name(url, kwargs)
+        started = time.time()
+        response = None
+        error = None
+        try:
+            response = request(url, method, **kwargs)
+            return response
+        except Exception as e:
+            response = getattr(e, 'response', None)
+            error = e
+            raise
+        finally:
+            exchange = {
+                'time'      : round(started, 3),
+                'pid'       : os.getpid(),
+                'task'      : self.task,
+                'key'       : _exchange_key(endpoint, method, url),
+                'json'      : None if endpoint == 'identity' else _scrub(kwargs.get('json')),
+                'status'    : _http_status(response, error),
+                'headers'   : _scrub_headers(getattr(response, 'headers', None)),
+                'body'      : self._body(response, endpoint),
+                'duration'  : round(time.time() - started, 6),
+                'error'     : None
+            }
+            if not error == None:
+                exchange['error'] = {'module': type(error).__module__, 'type': type(error).__name__,
+                                     'message': str(error)}
+            line = (json.dumps(exchange, sort_keys=True, default=str) + '\n').encode('utf-8')
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+#
+# 認証のレスポンスの秘密情報の置き換え (ユーザ名は API 鍵のため置き換える)
+#
+def _scrub_identity(body):
+    body = _scrub(body)
+    user = (body.get('token') or {}).get('user')
+    if isinstance(user, dict) and 'name' in user:
+        user['name'] = SCRUBBED
+    return body
+
+#
+# 記録に無いリクエストを再生しようとした場合の例外
+#
+class Ecl2ReplayError(Exception):
+
+    def __init__(self, message, error_type=None, http_status=None):
+        super(Ecl2ReplayError, self).__init__(message)
+        self.error_type = error_type
+        self.http_status = http_status
+
+#
+# API のやり取りの再生 (レイヤー)
+#
+# - API には送信せず、同じ メソッド / 送信先 / URL の記録を順に返す
+# - latency=True の場合は記録された時間だけ待つ
+# - 認証のトークンは有効期限を延ばして返す (再認証を繰り返さないため)
+# - 再生した数 / 使用しなかった記録の数 を stats に記録する (API 呼び出し回数の変化の確認に使用する)
+#
+class Ecl2Replay(object):
+
+    def __init__(self, path, latency=True):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.exchanges = {}
+        total = 0
+        with open(os.path.expanduser(path)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                exchange = json.loads(line)
+                self.exchanges.setdefault(exchange['key'], []).append(exchange)
+                total += 1
+        self.stats = {'recorded': total, 'replayed': 0, 'unused': total, 'missing': 0}
+
+    def _response(self, exchange, url):
+        import requests
+        response = requests.models.Response()
+        response.status_code = exchange['status']
+        response.url = url
+        response.encoding = 'utf-8'
+        response.headers = requests.structures.CaseInsensitiveDict(exchange.get('headers') or {})
+        body = exchange.get('body') or ''
+        if exchange['key'].split(' ')[1] == 'identity' and body:
+            body = json.dumps(_extend_token(json.loads(body)))
+        response._content = body.encode('utf-8')
+        return response
+
+    def _error(self, exchange, response):
+        error = exchange['error']
+        try:
+            module = __import__(error['module'], fromlist=[error['type']])
+            e = getattr(module, error['type'])(error['message'])
+        except Exception:
+            e = Ecl2ReplayError(error['message'], error['type'])
+        try:
+            e.http_status = exchange['status']
+            e.response = response
+        except AttributeError:
+            pass
+        return e
+
+    def __call__(self, request, url, method, **kwargs):
+        key = _exchange_key(_endpoint_name(url, kwargs), method, url)
+        with self.lock:
+            queue = self.exchanges.get(key) or []
+            if len(queue) == 0:
+                self.stats['missing'] += 1
+                raise Ecl2ReplayError('No recorded response for %s' % key)
+            exchange = queue.pop(0)
+            self.stats['replayed'] += 1
+            self.stats['unused'] -= 1
+
+        if self.latency:
+            time.sleep(exchange.get('duration') or 0)
+        response = None
+        if not exchange['status'] == None:
+            response = self._response(exchange, url)
+        if not exchange.get('error') == None:
+            raise self._error(exchange, response)
+        return response
+
+#
+# 記録されたトークンの有効期限を延ばす
+#
+def _extend_token(body):
+    token = body.get('token')
+    if isinstance(token, dict) and 'expires_at' in token:
+        token['expires_at'] = time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(time.time() + 86400))
+    return body
+
+#
+# サーキットブレーカーが遮断中の場合の例外
+#
+class Ecl2CircuitOpenError(Exception):
+    pass
+
+#
+# サーキットブレーカー (レイヤー)
+#
+# - テナント / 送信先 毎の状態をファイルに保存し、コントローラ上の全てのモジュールで共有する
+# - 5xx / 接続失敗 が threshold 回続いたら遮断し (open)、以降のリクエストは送信せずにエラーとする
+# - reset_timeout 秒経過後、1つのリクエストだけを試しに送信し (half_open)、
+#   成功すれば元に戻し (closed)、失敗すれば再び遮断する
+#
+class Ecl2CircuitBreaker(object):
+
+    def __init__(self, tenant, threshold=CIRCUIT_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT, path=None):
+        self.tenant = tenant
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.path = ecl2_cache_path('circuit.json', path)
+
+    def _key(self, endpoint):
+        return '%s:%s' % (self.tenant[:16], endpoint)
+
+    def _update(self, function):
+        fd = _lock_file(self.path + '.lock')
+        try:
+            data = _read_json(self.path) or {}
+            original = json.dumps(data, sort_keys=True)
+            result = function(data, time.time())
+            if not json.dumps(data, sort_keys=True) == original:
+                _write_json(self.path, data)
+        finally:
+            _unlock_file(fd)
+        return result
+
+    def _message(self, endpoint, entry, now):
+        return ('ECL2.0 API (%s) is unavailable: circuit breaker is open after %d consecutive failures, retry after %d seconds.'
+                % (endpoint, entry['failures'], max(0, int(math.ceil(entry['opened_at'] + self.reset_timeout - now)))))
+
+    #
+    # 遮断中の送信先があればエラーメッセージを返す (試しに送信できる場合を除く)
+    #
+    def check(self):
+        data = _read_json(self.path) or {}
+        now = time.time()
+        prefix = self._key('')
+        for key, entry in sorted(data.items()):
+            if key.startswith(prefix) and entry['state'] == 'open' and now < entry['opened_at'] + self.reset_timeout:
+                return self._message(key[len(prefix):], entry, now)
+        return None
+
+    #
+    # 送信してよいか (遮断中の場合は Ecl2CircuitOpenError)
+    #
+    def before(self, endpoint):
+        def update(data, now):
+            entry = data.get(self._key(endpoint))
+            if entry == None or entry['state'] == 'closed':
+                return None
+            if now < entry['opened_at'] + self.reset_timeout:
+                return self._message(endpoint, entry, now)
+            # 遮断時間が過ぎたら1つだけ試しに送信する (他は遮断中として扱う)
+            entry['state'] = 'half_open'
+            entry['opened_at'] = now
+            return None
+        error = self._update(update)
+        if not error == None:
+            raise Ecl2CircuitOpenError(error)
+
+    def after(self, endpoint, failed):
+        def update(data, now):
+            key = self._key(endpoint)
+            entry = data.get(key) or {'state': 'closed', 'failures': 0, 'opened_at': 0}
+            if not failed:
+                if entry['state'] == 'closed' and entry['failures'] == 0:
+                    return
+                entry.update(state='closed', failures=0)
+            else:
+                entry['failures'] += 1
+                if entry['state'] == 'half_open' or entry['failures'] >= self.threshold:
+                    entry.update(state='open', opened_at=now)
+            data[key] = entry
+        self._update(update)
+
+    def __call__(self, request, url, method, **kwargs):
+        endpoint = _endpoint_name(url, kwargs)
+        self.before(endpoint)
+        try:
+            response = request(url, method, **kwargs)
+        except Exception as e:
+            status = _http_status(getattr(e, 'response', None), e)
+            failed = status in CIRCUIT_FAILURE_STATUSES or (status == None and _is_connect_failure(e))
+            self.after(endpoint, failed)
+            raise
+        self.after(endpoint, _http_status(response, None) in CIRCUIT_FAILURE_STATUSES)
+        return response
+
+#
+# 同一の参照呼び出しの共有
+#
+# - 同じ API を同じ引数で呼び出した場合、実行中または window 秒以内に終わった呼び出しの結果を共有する
+# - 更新系の API (create_* / update_* / delete_*) を呼び出した場合は共有している結果を破棄する
+#   (ブローカーはテナント毎のため、プロセス内の結果は全て同じテナントのもの)
+#
+def _is_write_method(method):
+    return any(method.startswith(prefix) for prefix in WRITE_METHOD_PREFIXES)
+
+def _coalesce_key(tenant, service, method, args, kwargs):
+    source = json.dumps([tenant, service, method, list(args), kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+#
+# ジェネレータ等は共有できるようリストにする
+#
+def _materialize(value):
+    if _is_iterator(value):
+        return list(value)
+    return value
+
+def _is_iterator(value):
+    try:
+        return iter(value) is value
+    except TypeError:
+        return False
+
+#
+# プロセス内での共有 (ブローカーで使用する)
+#
+class Ecl2Coalescer(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    #
+    # (結果, 共有したかどうか) を返す
+    #
+    def call(self, key, function, window=0):
+        arrived = time.time()
+        with self.lock:
+            entry = self.calls.get(key)
+            if not entry == None and (not entry['done'].is_set() or entry['finished'] >= arrived - window):
+                leader = False
+            else:
+                entry = {'done': threading.Event(), 'finished': None, 'result': None, 'error': None}
+                self.calls[key] = entry
+                leader = True
+                for other_key, other in list(self.calls.items()):
+                    if other['done'].is_set() and other['finished'] < arrived - max(window, COALESCE_WINDOW):
+                        del self.calls[other_key]
+
+        if leader:
+            try:
+                entry['result'] = _materialize(function())
+            except Exception as e:
+                entry['error'] = e
+            entry['finished'] = time.time()
+            entry['done'].set()
+        else:
+            entry['done'].wait()
+
+        if not entry['error'] == None:
+            raise entry['error']
+        return entry['result'], not leader
+
+    def invalidate(self):
+        with self.lock:
+            for key, entry in list(self.calls.items()):
+                if entry['done'].is_set():
+                    del self.calls[key]
+
+#
+# プロセス間での共有 (直接接続で使用する)
+#
+# - 呼び出し毎のロックファイルで同時に1つのプロセスだけが API を呼び出し、
+#   結果を共有ファイルに書き込む
+# - ロックを待っていたプロセスは、待ち始めてから終わった呼び出しの結果を使用する
+# - 共有ファイル名にはテナント毎の接頭辞を付け、破棄は同じテナントのものだけに行う
+#
+class Ecl2FileCoalescer(object):
+
+    def __init__(self, tenant, path=None):
+        self.tenant = tenant
+        self.directory = os.path.dirname(ecl2_cache_path(os.path.join('coalesce', 'calls'), path))
+        self.prefix = hashlib.sha256(str(tenant).encode('utf-8')).hexdigest()[:16] + '-'
+        self.stats = {'calls': 0, 'shared': 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, self.prefix + key)
+
+    def call(self, key, function, window=0):
+        arrived = time.time()
+        path = self._path(key)
+        fd = _lock_file(path + '.lock')
+        try:
+            entry = _read_json(path + '.json')
+            if not entry == None and entry['finished'] >= arrived - window:
+                self.stats['shared'] += 1
+                return _decode_resources(entry['result']), True
+
+            result = _materialize(function())
+            _write_json(path + '.json', {'finished': time.time(), 'result': _encode_resources(result)})
+            self.stats['calls'] += 1
+        finally:
+            _unlock_file(fd)
+        self._cleanup()
+        return result, False
+
+    #
+    # 共有している結果を破棄する (同じテナントのもの)
+    #
+    def invalidate(self):
+        for filename in os.listdir(self.directory):
+            if filename.startswith(self.prefix) and filename.endswith('.json'):
+                try:
+                    os.unlink(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    #
+    # 古い共有ファイル / ロックファイルを削除する
+    #
+    def _cleanup(self):
+        now = time.time()
+        for filename in os.listdir(self.directory):
+            filename = os.path.join(self.directory, filename)
+            try:
+                if os.path.getmtime(filename) < now - COALESCE_CLEANUP_AGE:
+                    os.unlink(filename)
+            except OSError:
+                pass
+
+#
+# 参照呼び出しを共有する接続 (その他の属性は元の接続を参照する)
+#
+class Ecl2CoalescingConnection(object):
+
+    def __init__(self, connection, coalescer, window=COALESCE_WINDOW):
+        self._connection = connection
+        self.storage = _Ecl2CoalescingService(connection.storage, 'storage', coalescer, window)
+        self.network = _Ecl2CoalescingService(connection.network, 'network', coalescer, window)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+class _Ecl2CoalescingService(object):
+
+    def __init__(self, service, name, coalescer, window):
+        self._service = service
+        self._name = name
+        self._coalescer = coalescer
+        self._window = window
+
+    def __getattr__(self, method):
+        function = getattr(self._service, method)
+        if method.startswith('_') or not callable(function):
+            return function
+
+        def call(*args, **kwargs):
+            if _is_write_method(method):
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._coalescer.invalidate()
+            if not method in READ_METHODS:
+                return function(*args, **kwargs)
+            key = _coalesce_key(getattr(self._coalescer, 'tenant', None), self._name, method, args, kwargs)
+            return self._coalescer.call(key, lambda: function(*args, **kwargs), self._window)[0]
+        return call
+
+#
+# 名前インデックスの取得 (cache=bypass の場合は None)
+#
+def ecl2_name_index_from_module(module):
+    mode = module.params.get('cache', 'bypass')
+    if mode == 'bypass' or not HAS_SQLITE3:
+        return None
+    return Ecl2NameIndex(_RUN_STATE['tenant'],
+                         path=module.params.get('cache_path'),
+                         ttl=module.params.get('cache_ttl', NAME_INDEX_TTL),
+                         refresh=(mode == 'refresh'))
+
+#
+# リソース名 → ID / 概要 の ローカルインデックス (SQLite)
+#
+# - テナント / リソース種別 / 名前 毎に概要を保存し、cache_ttl 秒の間有効とする
+# - インデックスに無い名前は API で確認する (古い情報で存在しないと判断しない)
+# - モジュール自身の作成 / 削除 は put / forget で即時に反映する
+#
+class Ecl2NameIndex(object):
+
+    def __init__(self, tenant, path=None, ttl=NAME_INDEX_TTL, refresh=False):
+        self.tenant = tenant
+        self.ttl = ttl
+        #
+        # refresh の場合はこの実行より前に保存された情報を参照しない
+        #
+        self.not_before = time.time() if refresh else 0
+        self.path = ecl2_cache_path('index.sqlite', path)
+        if not os.path.exists(self.path):
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        self.db = sqlite3.connect(self.path, timeout=30)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS names ('
+                            'tenant TEXT, kind TEXT, id TEXT, name TEXT, record TEXT, updated_at REAL, '
+                            'PRIMARY KEY (tenant, kind, id))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS names_name '
+                            'ON names (tenant, kind, name)')
+
+    def _rows(self, kind, records):
+        now = time.time()
+        return [(self.tenant, kind, record['id'], record['name'], json.dumps(record), now)
+                for record in records]
+
+    #
+    # 名前で検索 (見つからない / 期限切れ の場合は空のリスト)
+    #
+    def get(self, kind, name):
+        rows = self.db.execute('SELECT record FROM names WHERE tenant = ? AND kind = ? AND name = ? '
+                               'AND updated_at >= ? AND updated_at > ?',
+                               (self.tenant, kind, name, self.not_before, time.time() - self.ttl)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    #
+    # 一覧全体を保存
+    #
+    def store(self, kind, records):
+        with self.db:
+            self.db.execute('DELETE FROM names WHERE tenant = ? AND kind = ?', (self.tenant, kind))
+            self.db.executemany('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?, ?, ?)',
+                                self._rows(kind, records))
+
+    #
+    # 追加 / 更新 (作成時・検索時)
+    #
+    def put(self, kind, *records):
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?, ?, ?)',
+                                self._rows(kind, records))
+
+    #
+    # 1件削除 (削除時)
+    #
+    def forget(self, kind, resource_id):
+        with self.db:
+            self.db.execute('DELETE FROM names WHERE tenant = ? AND kind = ? AND id = ?',
+                            (self.tenant, kind, resource_id))
+
+#
+# リソース種別毎の一覧取得
+#
+def _list_function(cloud_ecl2, kind, details=False):
+    if kind == 'storage':
+        return lambda **query: cloud_ecl2.storage.storages(details, **query)
+    if kind == 'volume':
+        return lambda **query: cloud_ecl2.storage.volumes(details, **query)
+    if kind == 'network':
+        return lambda **query: cloud_ecl2.network.networks(**query)
+    if kind == 'subnet':
+        return lambda **query: cloud_ecl2.network.subnets(**query)
+    raise ValueError('Unknown resource kind: %s' %(kind))
+
+#
+# 一覧をページ毎に取得するジェネレータ
+#
+# - limit / marker でページ毎に取得し、必要な分だけ読み進める
+# - ページングや検索条件を受け付けない SDK の場合は全件を取得する
+# - ページングを無視するエンドポイントに備えて、同じリソースは1度だけ返す
+#
+def ecl2_iter_resources(cloud_ecl2, kind, details=False, page_size=LIST_PAGE_SIZE, **query):
+    list_resources = _list_function(cloud_ecl2, kind, details)
+    seen = set()
+    marker = None
+    while True:
+        page_query = dict(query, limit=page_size)
+        if not marker == None:
+            page_query['marker'] = marker
+        try:
+            page = list(list_resources(**page_query))
+        except TypeError:
+            for resource in list_resources():
+                yield resource
+            return
+
+        new_resources = [resource for resource in page if not resource.id in seen]
+        for resource in new_resources:
+            seen.add(resource.id)
+            yield resource
+
+        #
+        # 最終ページ / ページングが無視された場合は終了
+        #
+        if len(new_resources) == 0 or not len(page) == page_size:
+            return
+        marker = page[-1].id
+
+#
+# 検索条件付きで一覧を取得
+# (検索条件を受け付けない SDK の場合は全件取得し、 全件かどうかも返す)
+#
+def _list_resources(list_resources, query):
+    if len(query) == 0:
+        return list_resources(), True
+    try:
+        return list_resources(**query), False
+    except TypeError:
+        return list_resources(), True
+
+#
+# 検索条件に一致するかどうか
+#
+def _match_query(resource_dict, query):
+    for key, value in query.items():
+        if not resource_dict.get(key) == value:
+            return False
+    return True
+
+#
+# 1回の実行の間のリソース一覧のスナップショット
+#
+# - 種別 / 検索条件 毎に一覧の取得結果を保持し、同じ一覧は実行中に1度だけ取得する
+# - 名前 (と指定された条件) を API の検索条件として送り、一致したものだけを取得する
+# - 検索条件を無視するエンドポイントに備えて、取得結果は手元でも比較する
+# - 取得結果から 名前 → リソース のハッシュインデックスを作成し、名前の重複を検出する
+# - 名前インデックスがあれば先に参照し (詳細が必要な場合を除く)、取得結果を保存する
+#
+class Ecl2Snapshot(object):
+
+    def __init__(self, module, cloud_ecl2, index=None, details=False, records=None):
+        self.module = module
+        self.cloud_ecl2 = cloud_ecl2
+        self.index = index
+        self.details = details
+        self._listings = {}
+
+        #
+        # 保存したスナップショットから作成した場合は API を呼び出さない
+        #
+        self.offline = not records == None
+        if self.offline:
+            for kind, kind_records in records.items():
+                self._listings[(kind, ())] = self._new_listing({}, list(kind_records))
+
+    def _new_listing(self, query, records):
+        by_name = {}
+        for record in records:
+            by_name.setdefault(record['name'], []).append(record)
+        return {'query': dict(query), 'records': records, 'by_name': by_name}
+
+    #
+    # 一覧の取得 (取得済みの場合は保持している結果を返す)
+    #
+    def _listing(self, kind, query):
+        key = (kind, tuple(sorted(query.items())))
+        if not key in self._listings and self.offline:
+            full = self._listings.get((kind, ()))
+            if full == None:
+                ecl2_fail_json(self.module, msg='Plan snapshot does not contain %s.' %(kind))
+            records = [record for record in full['records'] if _match_query(record, query)]
+            self._listings[key] = self._new_listing(query, records)
+        if not key in self._listings:
+            resources, complete = _list_resources(_list_function(self.cloud_ecl2, kind, self.details), query)
+            records = [resource.to_dict() for resource in resources]
+
+            #
+            # 全件取得した場合は全件の一覧として保持し、名前インデックスも置き換える
+            #
+            if complete:
+                listing = self._new_listing({}, records)
+                self._listings[(kind, ())] = listing
+                if not self.index == None:
+                    self.index.store(kind, records)
+
+            #
+            # 検索条件を無視するエンドポイントに備えて手元でも比較する
+            #
+            records = [record for record in records if _match_query(record, query)]
+            self._listings[key] = self._new_listing(query, records)
+            if not complete and not self.index == None:
+                self.index.put(kind, *records)
+        return self._listings[key]
+
+    #
+    # 一覧 (検索条件を指定しない場合は全件)
+    #
+    def list(self, kind, **query):
+        return list(self._listing(kind, query)['records'])
+
+    #
+    # 名前で検索 (一致したもの全て)
+    #
+    def find_all(self, kind, name, **query):
+        #
+        # 全件の一覧を取得済みの場合はそこから検索
+        #
+        full = self._listings.get((kind, ()))
+        if not full == None:
+            return [record for record in full['by_name'].get(name, []) if _match_query(record, query)]
+
+        #
+        # 名前インデックスを参照
+        # (インデックスには概要が保存されている場合があるため、詳細が必要な場合は参照しない)
+        #
+        if not self.index == None and not self.details:
+            records = [record for record in self.index.get(kind, name) if _match_query(record, query)]
+            if len(records) > 0:
+                return records
+
+        query['name'] = name
+        return list(self._listing(kind, query)['records'])
+
+    #
+    # 名前で検索 (名前が重複している場合はエラー)
+    #
+    def find(self, kind, name, **query):
+        records = self.find_all(kind, name, **query)
+        if len(records) > 1:
+            ecl2_fail_json(self.module, msg='Name of %s(%s) is duplicated: %s'
+                                        %(kind, name, ', '.join([record['id'] for record in records])))
+        if len(records) == 0:
+            return None
+        return records[0]
+
+    #
+    # ID で取得 (存在しない場合は None)
+    #
+    def get(self, kind, resource_id):
+        if self.offline:
+            records = [record for record in self._listing(kind, {})['records'] if record['id'] == resource_id]
+            return records[0] if len(records) > 0 else None
+        if kind == 'storage':
+            return get_storage(self.cloud_ecl2, resource_id)
+        return get_storage_volume(self.cloud_ecl2, resource_id)
+
+    #
+    # 作成したリソースを反映
+    #
+    def created(self, kind, record):
+        for (listing_kind, _), listing in self._listings.items():
+            if listing_kind == kind and _match_query(record, listing['query']):
+                listing['records'].append(record)
+                listing['by_name'].setdefault(record['name'], []).append(record)
+        if not self.index == None:
+            self.index.put(kind, record)
+
+    #
+    # 削除したリソースを反映
+    #
+    def deleted(self, kind, resource_id):
+        for (listing_kind, _), listing in self._listings.items():
+            if listing_kind == kind:
+                listing['records'] = [record for record in listing['records'] if not record['id'] == resource_id]
+                for name, records in list(listing['by_name'].items()):
+                    listing['by_name'][name] = [record for record in records if not record['id'] == resource_id]
+        if not self.index == None:
+            self.index.forget(kind, resource_id)
+
+#
+# スナップショットの作成
+#
+# plan_snapshot が指定された場合は、保存したスナップショットのファイルから作成する
+# (API を呼び出さないため、チェックモードでのみ使用できる)
+#
+def ecl2_snapshot_from_module(module, cloud_ecl2, details=False):
+    path = module.params.get('plan_snapshot')
+    if path == None:
+        return Ecl2Snapshot(module, cloud_ecl2, ecl2_name_index_from_module(module), details)
+    if not module.check_mode:
+        ecl2_fail_json(module, msg='plan_snapshot can only be used in check mode.')
+    data = _read_json(os.path.expanduser(path))
+    if not isinstance(data, dict) or not isinstance(data.get('resources'), dict):
+        ecl2_fail_json(module, msg='Plan snapshot(%s) is not exist or invalid.' %(path))
+    return Ecl2Snapshot(module, None, details=details, records=data['resources'])
+
+#
+# スナップショットのファイルを保存 (リソース種別 → 一覧)
+#
+def ecl2_save_snapshot(path, resources):
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    _write_json(path, {'created_at': int(time.time()), 'resources': resources})
+
+#
+# 並列実行
+#
+# - 最大 max_concurrency 個のスレッドで items を処理する
+# - 入力順に (戻り値, 例外) の組のリストを返す
+#
+def run_concurrently(function, items, max_concurrency=10):
+    items = list(items)
+    results = [None] * len(items)
+    lock = threading.Lock()
+    position = [0]
+
+    def worker():
+        while True:
+            with lock:
+                i = position[0]
+                if i >= len(items):
+                    return
+                position[0] += 1
+            try:
+                results[i] = (function(items[i]), None)
+            except Exception as e:
+                results[i] = (None, e)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(max_concurrency, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+#
+# 複数リソースの状態待ち
+#
+# - 待機中のリソースはポーリング毎に1回の一覧取得でまとめて確認する (1件の場合は ID で取得)
+# - ポーリング間隔は指数的に伸ばし、ゆらぎを加える
+# - error で始まる状態になったリソースはその時点で失敗とする
+# - リソース毎に完了までの時間を記録する
+#
+class Ecl2Waiter(object):
+
+    def __init__(self, cloud_ecl2, kind, timeout, interval=WAIT_INTERVAL, max_interval=WAIT_MAX_INTERVAL):
+        self.kind = kind
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.targets = {}
+        if kind == 'storage':
+            self._list = lambda: cloud_ecl2.storage.storages(True)
+            self._get = lambda resource_id: get_storage(cloud_ecl2, resource_id)
+        else:
+            self._list = lambda: cloud_ecl2.storage.volumes(True)
+            self._get = lambda resource_id: get_storage_volume(cloud_ecl2, resource_id)
+
+    #
+    # 待機するリソースの追加 (削除を待つ場合は status='deleted')
+    #
+    def add(self, resource_id, status='available'):
+        self.targets[resource_id] = status
+
+    #
+    # 現在の状態を取得 (存在しないリソースは含まない)
+    #
+    def statuses(self, resource_ids):
+        if len(resource_ids) == 1:
+            resource = self._get(resource_ids[0])
+            if resource == None:
+                return {}
+            return {resource['id']: resource['status']}
+        statuses = {}
+        for resource in self._list():
+            resource_dict = resource.to_dict()
+            statuses[resource_dict['id']] = resource_dict['status']
+        return statuses
+
+    #
+    # 全てのリソースが完了 / 失敗 / タイムアウト するまで待機
+    #
+    # 結果は ID 毎の {'id', 'status', 'target', 'result', 'elapsed'}
+    # (result は converged / failed / timeout)
+    #
+    def wait(self):
+        started = time.time()
+        deadline = started + self.timeout
+        delay = self.interval
+        pending = dict(self.targets)
+        results = {}
+        for resource_id, target in pending.items():
+            results[resource_id] = {'id': resource_id, 'status': None, 'target': target,
+                                    'result': 'timeout', 'elapsed': None}
+
+        while len(pending) > 0:
+            statuses = self.statuses(list(pending.keys()))
+            now = time.time()
+            for resource_id, target in list(pending.items()):
+                status = statuses.get(resource_id, 'deleted')
+                result = results[resource_id]
+                result['status'] = status
+                result['result'] = _wait_result(status, target)
+                if result['result'] == None:
+                    result['result'] = 'timeout'
+                    continue
+                result['elapsed'] = round(now - started, 3)
+                del pending[resource_id]
+
+            if len(pending) == 0 or now >= deadline:
+                break
+            time.sleep(max(0, min(delay * random.uniform(1 - WAIT_JITTER, 1 + WAIT_JITTER), deadline - now)))
+            delay = min(delay * WAIT_BACKOFF, self.max_interval)
+
+        for resource_id in pending:
+            results[resource_id]['elapsed'] = round(time.time() - started, 3)
+        _RUN_INFO.setdefault('ecl2_waits', []).extend(
+            [dict(result, kind=self.kind) for result in results.values()])
+        metrics = _RUN_INFO.get('ecl2_metrics')
+        if not metrics == None:
+            metrics['wait'] = round(metrics.get('wait', 0) + time.time() - started, 3)
+        return results
+
+#
+# 状態の判定 (完了: converged / 失敗: failed / 処理中: None)
+#
+# (作成直後で一覧に現れていない場合は処理中とする)
+#
+def _wait_result(status, target):
+    if status == target:
+        return 'converged'
+    if str(status).startswith('error'):
+        return 'failed'
+    return None
+
+#
+# 非同期処理のジョブ (リソースの ID / 目標の状態 / 期限)
+#
+def ecl2_job(kind, resource, target, timeout):
+    return {
+        'kind'     : kind,
+        'id'       : resource['id'],
+        'name'     : resource.get('name'),
+        'target'   : target,
+        'deadline' : int(time.time() + timeout)
+    }
+
+#
+# 名前のパターンの判定 (pattern_type: glob / regex)
+#
+def ecl2_name_pattern(module):
+    pattern = module.params['name_pattern']
+    if module.params['pattern_type'] == 'regex':
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            ecl2_fail_json(module, msg='name_pattern(%s) is not a valid regex: %s' %(pattern, e))
+        return lambda name: not regex.search(name) == None
+    return lambda name: fnmatch.fnmatchcase(name, pattern)
+
+#
+# 複数のリソースを並列に削除
+#
+# - 削除中のリソースは削除せず (skipped)、完了の待機だけを行う
+# - 削除は最大 max_concurrency 件ずつ並列に実行する
+# - wait=True の場合は全てのリソースが無くなるまでまとめて待機する
+#
+# 結果はリソース毎の {'name', 'id', 'changed', 'skipped', 'job', 'status', 'elapsed', 'failed', 'msg'}
+#
+def ecl2_delete_resources(cloud_ecl2, snapshot, kind, records, max_concurrency, timeout, wait):
+    if kind == 'storage':
+        delete = cloud_ecl2.storage.delete_storage
+    else:
+        delete = cloud_ecl2.storage.delete_volume
+
+    results = []
+    targets = []
+    for record in records:
+        result = {'name': record['name'], 'id': record['id'], 'changed': False}
+        if record.get('status') in DELETING_STATUSES:
+            result['skipped'] = True
+            result['status'] = record['status']
+        else:
+            targets.append((record, result))
+        results.append(result)
+
+    outcomes = run_concurrently(lambda target: delete(target[0]['id']), targets, max_concurrency)
+    for (record, result), (_, error) in zip(targets, outcomes):
+        if not error == None:
+            result['failed'] = True
+            result['msg'] = str(error)
+            continue
+        result['changed'] = True
+        result['job'] = ecl2_job(kind, record, 'deleted', timeout)
+        snapshot.deleted(kind, record['id'])
+
+    if wait == True:
+        waiter = Ecl2Waiter(cloud_ecl2, kind, timeout)
+        for result in results:
+            if not result.get('failed'):
+                waiter.add(result['id'], 'deleted')
+        if len(waiter.targets) > 0:
+            waits = waiter.wait()
+            for result in results:
+                if result['id'] in waits:
+                    wait_result = waits[result['id']]
+                    result['status'] = wait_result['status']
+                    result['elapsed'] = wait_result['elapsed']
+                    error = ecl2_wait_error({result['id']: wait_result})
+                    if not error == None:
+                        result['failed'] = True
+                        result['msg'] = error
+    return results
+
+#
+# チェックモードの計画 (create / delete / update / none) と差分
+#
+# before は現在の状態 (存在しない場合は None)、after は反映後の状態 (削除する場合は None)
+#
+def ecl2_plan(kind, name, before, after):
+    if before == None:
+        action = 'none' if after == None else 'create'
+    elif after == None:
+        action = 'delete'
+    else:
+        action = 'none' if before == after else 'update'
+    return {
+        'kind'      : kind,
+        'name'      : name,
+        'action'    : action,
+        'id'        : None if before == None else before.get('id'),
+        'diff'      : {
+            'before_header' : '%s(%s)' %(kind, name),
+            'after_header'  : '%s(%s)' %(kind, name),
+            'before'        : before or {},
+            'after'         : after or {}
+        }
+    }
+
+#
+# 複数のジョブの状態を確認 (リソースの種別毎に1回の API 呼び出し)
+#
+# ジョブ毎に status と result (converged / failed / timeout / pending) を付与して返す
+#
+def ecl2_check_jobs(cloud_ecl2, jobs):
+    statuses = {}
+    for kind in set([job['kind'] for job in jobs]):
+        resource_ids = [job['id'] for job in jobs if job['kind'] == kind]
+        statuses[kind] = Ecl2Waiter(cloud_ecl2, kind, 0).statuses(resource_ids)
+
+    now = time.time()
+    results = []
+    for job in jobs:
+        status = statuses[job['kind']].get(job['id'], 'deleted')
+        result = _wait_result(status, job['target'])
+        if result == None:
+            result = 'timeout' if job['deadline'] <= now else 'pending'
+        results.append(dict(job, status=status, result=result))
+    return results
+
+#
+# 待機結果のエラーメッセージ (全て完了した場合は None)
+#
+def ecl2_wait_error(results):
+    errors = []
+    for result in results.values():
+        if result['result'] == 'failed':
+            errors.append('%s became %s' %(result['id'], result['status']))
+        elif result['result'] == 'timeout':
+            errors.append('%s did not become %s (status: %s)' %(result['id'], result['target'], result['status']))
+    if len(errors) == 0:
+        return None
+    return ', '.join(errors)
+
+#
+# リソースが存在しない場合の例外かどうか
+#
+def _is_not_found(e):
+    error_type = getattr(e, 'error_type', None) or type(e).__name__
+    return getattr(e, 'http_status', None) == 404 or 'NotFound' in error_type
+
+#
+# 仮想ストレージを ID で取得
+#
+def get_storage(cloud_ecl2, storage_id):
+    try:
+        return cloud_ecl2.storage.get_storage(storage_id).to_dict()
+    except Exception as e:
+        if _is_not_found(e):
+            return None
+        raise
+
+#
+# 仮想ストレージのボリュームを ID で取得
+#
+def get_storage_volume(cloud_ecl2, volume_id):
+    try:
+        return cloud_ecl2.storage.get_volume(volume_id).to_dict()
+    except Exception as e:
+        if _is_not_found(e):
+            return None
+        raise